@@ -1,17 +1,23 @@
 import random
 import logging
+import multiprocessing
 from PySide2 import QtWidgets, QtCore
 from PySide2.QtWidgets import QCheckBox
-from PySide2.QtCore import Qt
+import shiboken2
 from shiboken2 import wrapInstance
-import pymel.core as pm
 import maya.cmds as cmds
 import maya.OpenMayaUI as omui
-from pymel.core.system import Path
+
+import scatter_core
+import timing
+from scatter_core import ScatterFX
+from scatter_maya import MayaBackend, bake_instancer, selected_vertices
 
 
 log = logging.getLogger(__name__)
 
+JOB_FILE_FILTER = "Scatter Jobs (*.json)"
+
 
 def maya_main_window():
     """Return the Maya main window widget"""
@@ -21,15 +27,29 @@ def maya_main_window():
 
 class ScatterToolUI(QtWidgets.QDialog):
     """Scatter Tool UI Class"""
+    _instance = None
+
+    @classmethod
+    def show_dialog(cls):
+        """Show the dialog, reusing the one built by an earlier launch"""
+        if cls._instance is None or not shiboken2.isValid(cls._instance):
+            cls._instance = cls()
+        cls._instance.show()
+        cls._instance.raise_()
+        cls._instance.activateWindow()
+        return cls._instance
 
     def __init__(self):
         super(ScatterToolUI, self).__init__(parent=maya_main_window())
         self.setWindowTitle("Scatter Tool")
         self.setMinimumWidth(500)
-        self.setMaximumHeight(300)
+        self.setMaximumHeight(530)
         self.setWindowFlags(self.windowFlags() ^
                             QtCore.Qt.WindowContextHelpButtonHint)
         self.set_scatter = ScatterFX()
+        self.backend = MayaBackend()
+        self.scatter_cache = scatter_core.ScatterCache()
+        self.scatter_queue = scatter_core.ScatterQueue()
         self.create_ui()
         self.create_connections()
 
@@ -41,7 +61,14 @@ class ScatterToolUI(QtWidgets.QDialog):
         self.rot_min_lay = self._create_rot_min_ui()
         self.rot_max_lay = self._create_rot_max_ui()
         self.normals_lay = self.create_normals_checkbox()
+        self.output_lay = self._create_output_ui()
+        self.distribution_lay = self._create_distribution_ui()
+        self.overlap_lay = self._create_overlap_ui()
+        self.sampling_lay = self._create_sampling_ui()
+        self.density_map_lay = self._create_density_map_ui()
         self.button_lay = self._create_button_ui()
+        self.queue_lay = self._create_queue_ui()
+        self.progress_lay = self._create_progress_ui()
         self.main_lay = QtWidgets.QVBoxLayout()
         self.ui_add_layout()
         self.main_lay.addStretch()
@@ -55,12 +82,28 @@ class ScatterToolUI(QtWidgets.QDialog):
         self.main_lay.addLayout(self.rot_min_lay)
         self.main_lay.addLayout(self.rot_max_lay)
         self.main_lay.addLayout(self.normals_lay)
+        self.main_lay.addLayout(self.output_lay)
+        self.main_lay.addLayout(self.distribution_lay)
+        self.main_lay.addLayout(self.overlap_lay)
+        self.main_lay.addLayout(self.sampling_lay)
+        self.main_lay.addLayout(self.density_map_lay)
         self.main_lay.addLayout(self.button_lay)
+        self.main_lay.addLayout(self.queue_lay)
+        self.main_lay.addLayout(self.progress_lay)
 
     def create_connections(self):
         """Connects Signals and Slots"""
         self.scatter_btn.clicked.connect(self._scatter)
         self.scatter_rand_btn.clicked.connect(self._scatter_random)
+        self.cancel_btn.clicked.connect(self._cancel_scatter)
+        self.bake_btn.clicked.connect(self._bake_instancer)
+        self.distribution_cmb.currentTextChanged.connect(self._distribution_changed)
+        self.overlap_cbox.toggled.connect(self.padding_sbox.setEnabled)
+        self.add_job_btn.clicked.connect(self._add_job)
+        self.run_queue_btn.clicked.connect(self._run_queue)
+        self.clear_queue_btn.clicked.connect(self._clear_queue)
+        self.save_jobs_btn.clicked.connect(self._save_jobs)
+        self.load_jobs_btn.clicked.connect(self._load_jobs)
 
     @QtCore.Slot()
     def _scatter(self):
@@ -68,6 +111,87 @@ class ScatterToolUI(QtWidgets.QDialog):
         self._set_scatter_properties_from_ui()
         self.scatter_fx()
 
+    @QtCore.Slot(str)
+    def _distribution_changed(self, distribution):
+        """Switch between the vertex density and the surface point count"""
+        surface = distribution == "Surface"
+        self.point_count_sbox.setEnabled(surface)
+        self.dens_sbox.setEnabled(not surface)
+
+    @QtCore.Slot()
+    def _cancel_scatter(self):
+        """Stop the running scatter after the current chunk"""
+        self.scatter_cancelled = True
+
+    @QtCore.Slot()
+    def _bake_instancer(self):
+        """Bake the selected scatter instancers to instance transforms"""
+        instancers = cmds.ls(sl=True, type="instancer")
+        if not instancers:
+            print("Please select a scatter instancer to bake")
+            return
+        cmds.undoInfo(openChunk=True, chunkName="bake_instancer")
+        try:
+            for instancer in instancers:
+                bake_instancer(instancer)
+        finally:
+            cmds.undoInfo(closeChunk=True)
+
+    @QtCore.Slot()
+    def _add_job(self):
+        """Queue the selected sources and target vertices as a scatter job"""
+        sources = cmds.ls(sl=True, transforms=True)
+        vertices = selected_vertices()
+        if not sources or not vertices:
+            print("Please select the objects to instance and the target vertices")
+            return
+        self._set_scatter_properties_from_ui()
+        targets = [(mesh, list(indices)) for mesh, indices in vertices]
+        self.scatter_queue.add(scatter_core.ScatterJob(
+            sources, targets, self.set_scatter.settings()))
+        self._update_queue_label()
+
+    @QtCore.Slot()
+    def _run_queue(self):
+        """Run every queued scatter job"""
+        if not self.scatter_queue.jobs:
+            print("Please add a scatter job to the queue first")
+            return
+        self.run_queue()
+
+    @QtCore.Slot()
+    def _clear_queue(self):
+        """Remove every queued scatter job"""
+        self.scatter_queue.clear()
+        self._update_queue_label()
+
+    @QtCore.Slot()
+    def _save_jobs(self):
+        """Save the queued scatter jobs to a preset file"""
+        path, _ = QtWidgets.QFileDialog.getSaveFileName(
+            self, "Save Scatter Jobs", "", JOB_FILE_FILTER)
+        if path:
+            self.scatter_queue.save(path)
+
+    @QtCore.Slot()
+    def _load_jobs(self):
+        """Add the scatter jobs of a preset file to the queue"""
+        path, _ = QtWidgets.QFileDialog.getOpenFileName(
+            self, "Load Scatter Jobs", "", JOB_FILE_FILTER)
+        if not path:
+            return
+        try:
+            loaded = scatter_core.ScatterQueue.load(path)
+        except (IOError, ValueError, KeyError) as err:
+            log.error("Could not load scatter jobs from %s: %s", path, err)
+            return
+        for job in loaded.jobs:
+            self.scatter_queue.add(job)
+        self._update_queue_label()
+
+    def _update_queue_label(self):
+        self.queue_lbl.setText("%d Jobs Queued" % len(self.scatter_queue.jobs))
+
     @QtCore.Slot()
     def _scatter_random(self):
         """Randomly Generate Numbers for Each Setting"""
@@ -83,6 +207,18 @@ class ScatterToolUI(QtWidgets.QDialog):
         self.set_scatter.rot_x_max = self.rot_xmax_box.value()
         self.set_scatter.rot_y_max = self.rot_ymax_box.value()
         self.set_scatter.rot_z_max = self.rot_zmax_box.value()
+        self.set_scatter.align_to_normal = self.normals_cbox.isChecked()
+        self.set_scatter.up_axis = self.up_axis_cmb.currentText().lower()
+        self.set_scatter.output_mode = self.output_cmb.currentText().lower()
+        self.set_scatter.seed = self.seed_sbox.value()
+        self.set_scatter.workers = self.workers_sbox.value()
+        self.set_scatter.min_distance = self.min_dist_sbox.value()
+        self.set_scatter.density_source = self.density_src_cmb.currentText().lower()
+        self.set_scatter.density_map = self.density_map_le.text()
+        self.set_scatter.distribution = self.distribution_cmb.currentText().lower()
+        self.set_scatter.point_count = self.point_count_sbox.value()
+        self.set_scatter.reject_overlaps = self.overlap_cbox.isChecked()
+        self.set_scatter.overlap_padding = self.padding_sbox.value()
 
     def _create_button_ui(self):
         self.scatter_btn = QtWidgets.QPushButton("Execute Scatter Effect")
@@ -92,6 +228,32 @@ class ScatterToolUI(QtWidgets.QDialog):
         layout.addWidget(self.scatter_rand_btn)
         return layout
 
+    def _create_queue_ui(self):
+        self.queue_lbl = QtWidgets.QLabel("0 Jobs Queued")
+        self.add_job_btn = QtWidgets.QPushButton("Add Job")
+        self.run_queue_btn = QtWidgets.QPushButton("Run Queue")
+        self.clear_queue_btn = QtWidgets.QPushButton("Clear Queue")
+        self.save_jobs_btn = QtWidgets.QPushButton("Save Jobs...")
+        self.load_jobs_btn = QtWidgets.QPushButton("Load Jobs...")
+        layout = QtWidgets.QHBoxLayout()
+        layout.addWidget(self.queue_lbl)
+        layout.addWidget(self.add_job_btn)
+        layout.addWidget(self.run_queue_btn)
+        layout.addWidget(self.clear_queue_btn)
+        layout.addWidget(self.save_jobs_btn)
+        layout.addWidget(self.load_jobs_btn)
+        return layout
+
+    def _create_progress_ui(self):
+        self.progress_bar = QtWidgets.QProgressBar()
+        self.progress_bar.setValue(0)
+        self.cancel_btn = QtWidgets.QPushButton("Cancel")
+        self.cancel_btn.setEnabled(False)
+        layout = QtWidgets.QHBoxLayout()
+        layout.addWidget(self.progress_bar)
+        layout.addWidget(self.cancel_btn)
+        return layout
+
     def _create_density_sbox(self):
         layout = QtWidgets.QGridLayout()
         self.dens_sbox = QtWidgets.QSpinBox()
@@ -104,6 +266,96 @@ class ScatterToolUI(QtWidgets.QDialog):
         layout.addWidget(self.dens_lbl, 1, 5)
         return layout
 
+    def _create_output_ui(self):
+        layout = QtWidgets.QGridLayout()
+        self.output_cmb = QtWidgets.QComboBox()
+        self.output_cmb.addItems(["Instances", "Instancer"])
+        self.output_cmb.setFixedWidth(100)
+        self.output_lbl = QtWidgets.QLabel("Output")
+        self.bake_btn = QtWidgets.QPushButton("Bake Instancer to Transforms")
+        layout.addWidget(self.output_cmb, 1, 0)
+        layout.addWidget(self.output_lbl, 1, 1)
+        layout.addWidget(self.bake_btn, 1, 5)
+        return layout
+
+    def _create_distribution_ui(self):
+        layout = QtWidgets.QGridLayout()
+        self.distribution_cmb = QtWidgets.QComboBox()
+        self.distribution_cmb.addItems(["Vertices", "Surface"])
+        self.distribution_cmb.setFixedWidth(100)
+        self.distribution_cmb.setToolTip("Surface spreads points evenly by area "
+                                         "over the faces between the selected "
+                                         "vertices")
+        self.distribution_lbl = QtWidgets.QLabel("Distribution")
+        self.point_count_sbox = QtWidgets.QSpinBox()
+        self.point_count_sbox.setFixedWidth(100)
+        self.point_count_sbox.setRange(1, 10000000)
+        self.point_count_sbox.setValue(self.set_scatter.point_count)
+        self.point_count_sbox.setEnabled(False)
+        self.point_count_lbl = QtWidgets.QLabel("Surface Points")
+        layout.addWidget(self.distribution_cmb, 1, 0)
+        layout.addWidget(self.distribution_lbl, 1, 1)
+        layout.addWidget(self.point_count_sbox, 1, 2)
+        layout.addWidget(self.point_count_lbl, 1, 3)
+        return layout
+
+    def _create_overlap_ui(self):
+        layout = QtWidgets.QGridLayout()
+        self.overlap_cbox = QCheckBox("Reject Overlapping Instances", self)
+        self.overlap_cbox.setToolTip("Drop instances whose bounding sphere touches "
+                                     "an instance placed before them")
+        self.padding_sbox = QtWidgets.QDoubleSpinBox()
+        self.padding_sbox.setFixedWidth(100)
+        self.padding_sbox.setRange(0.0, 1000.0)
+        self.padding_sbox.setSingleStep(0.1)
+        self.padding_sbox.setValue(self.set_scatter.overlap_padding)
+        self.padding_sbox.setEnabled(False)
+        self.padding_lbl = QtWidgets.QLabel("Padding")
+        layout.addWidget(self.overlap_cbox, 1, 0)
+        layout.addWidget(self.padding_sbox, 1, 2)
+        layout.addWidget(self.padding_lbl, 1, 3)
+        return layout
+
+    def _create_sampling_ui(self):
+        layout = QtWidgets.QGridLayout()
+        self.seed_sbox = QtWidgets.QSpinBox()
+        self.seed_sbox.setFixedWidth(100)
+        self.seed_sbox.setRange(0, 999999)
+        self.seed_sbox.setSpecialValueText("Random")
+        self.seed_sbox.setValue(self.set_scatter.seed)
+        self.seed_lbl = QtWidgets.QLabel("Seed")
+        self.min_dist_sbox = QtWidgets.QDoubleSpinBox()
+        self.min_dist_sbox.setFixedWidth(100)
+        self.min_dist_sbox.setRange(0.0, 1000.0)
+        self.min_dist_sbox.setSingleStep(0.1)
+        self.min_dist_sbox.setValue(self.set_scatter.min_distance)
+        self.min_dist_lbl = QtWidgets.QLabel("Minimum Distance")
+        layout.addWidget(self.seed_sbox, 1, 0)
+        layout.addWidget(self.seed_lbl, 1, 1)
+        self.workers_sbox = QtWidgets.QSpinBox()
+        self.workers_sbox.setFixedWidth(50)
+        self.workers_sbox.setRange(1, multiprocessing.cpu_count())
+        self.workers_sbox.setValue(self.set_scatter.workers)
+        self.workers_lbl = QtWidgets.QLabel("Workers")
+        layout.addWidget(self.min_dist_sbox, 1, 4)
+        layout.addWidget(self.min_dist_lbl, 1, 5)
+        layout.addWidget(self.workers_sbox, 1, 6)
+        layout.addWidget(self.workers_lbl, 1, 7)
+        return layout
+
+    def _create_density_map_ui(self):
+        layout = QtWidgets.QGridLayout()
+        self.density_src_cmb = QtWidgets.QComboBox()
+        self.density_src_cmb.addItems(["None", "Vertex Colour", "Texture"])
+        self.density_src_cmb.setFixedWidth(100)
+        self.density_map_le = QtWidgets.QLineEdit(self.set_scatter.density_map)
+        self.density_map_le.setPlaceholderText("Texture node, e.g. file1")
+        self.density_map_lbl = QtWidgets.QLabel("Density Map")
+        layout.addWidget(self.density_src_cmb, 1, 0)
+        layout.addWidget(self.density_map_le, 1, 4)
+        layout.addWidget(self.density_map_lbl, 1, 5)
+        return layout
+
     def _create_scale_min_ui(self):
         layout = QtWidgets.QGridLayout()
         self.scale_min_sbox = QtWidgets.QDoubleSpinBox()
@@ -207,63 +459,90 @@ class ScatterToolUI(QtWidgets.QDialog):
 
     def create_normals_checkbox(self):
         self.normals_cbox = QCheckBox("Align to Normals", self)
-        self.normals_cbox.stateChanged.connect(self.checkbox_change)
         self.normals_cbox.toggle()
+        self.up_axis_lbl = QtWidgets.QLabel("Up Axis")
+        self.up_axis_cmb = QtWidgets.QComboBox()
+        self.up_axis_cmb.addItems(["X", "Y", "Z"])
+        self.up_axis_cmb.setFixedWidth(50)
+        self.up_axis_cmb.setCurrentText(cmds.upAxis(query=True, axis=True).upper())
         layout = QtWidgets.QHBoxLayout()
         layout.addWidget(self.normals_cbox, 5)
+        layout.addWidget(self.up_axis_lbl)
+        layout.addWidget(self.up_axis_cmb)
         return layout
 
-    def checkbox_change(self, state):
-        if state == Qt.Checked:
-            self.align_to_normal = True
-
-        else:
-            self.align_to_normal = False
+    def set_running(self, running):
+        """Disable every action button while a scatter loop is running"""
+        for button in (self.scatter_btn, self.scatter_rand_btn, self.bake_btn,
+                       self.add_job_btn, self.run_queue_btn,
+                       self.clear_queue_btn, self.save_jobs_btn,
+                       self.load_jobs_btn):
+            button.setEnabled(not running)
+        self.cancel_btn.setEnabled(running)
 
     def scatter_fx(self):
-        selection = cmds.ls(sl=True, fl=True)
-        vertex_names = cmds.filterExpand(selection, selectionMask=31, expand=True)
-
-        random.shuffle(vertex_names)
-        number_of_points = int(len(vertex_names) * self.dens_sbox.value() / 100)
-        random_sample = random.sample(vertex_names, number_of_points)
+        selection = cmds.ls(sl=True, head=1)
         object_to_instance = selection[0]
 
         if cmds.objectType(object_to_instance) == 'transform':
-            for vertex in random_sample:
-                new_instance = cmds.instance(object_to_instance)[0]
-                position = cmds.pointPosition(vertex, w=1)
-                cmds.move(position[0], position[1], position[2], new_instance, a=1, ws=1)
-
-                if self.align_to_normal:
-                    mesh_vert = pm.MeshVertex(vertex)
-                    vert_normal = mesh_vert.getNormal()
-                    up_vector = pm.dt.Vector(0.0, 1.0, 0.0)
-                    tangent = vert_normal.cross(up_vector).normal()
-                    tangent2 = vert_normal.cross(tangent).normal()
-                    pos = cmds.xform([vertex], query=True, worldSpace=True, translation=True)
-
-                    matrix_trans = [tangent2.x, tangent2.y, tangent2.z, 0.0,
-                                    vert_normal.x, vert_normal.y, vert_normal.z, 0.0,
-                                    tangent.x, tangent.y, tangent.z, 0.0,
-                                    pos[0], pos[1], pos[2], 1.0]
-
-                    cmds.xform(new_instance, worldSpace=True, matrix=matrix_trans)
-
-                new_rotation = [random.uniform(self.set_scatter.rot_x_min, self.set_scatter.rot_x_max),
-                                random.uniform(self.set_scatter.rot_y_min, self.set_scatter.rot_y_max),
-                                random.uniform(self.set_scatter.rot_z_min, self.set_scatter.rot_z_max)]
-
-                cmds.rotate(new_rotation[0], new_rotation[1], new_rotation[2], new_instance,
-                            r=1, ws=1)
-
-                new_scale = random.uniform(self.set_scatter.scale_min, self.set_scatter.scale_max)
-                cmds.scale(new_scale, new_scale, new_scale, new_instance,
-                           a=1, ws=1)
+            with timing.span("scatter.selection"):
+                vertices = selected_vertices()
+            points = self.set_scatter.sample_points(vertices, self.backend,
+                                                    self.scatter_cache)
+            self.progress_bar.setRange(0, len(points.positions))
+            self.progress_bar.setValue(0)
+            self.progress_bar.setFormat("%p%")
+            self.scatter_cancelled = False
+            self.set_running(True)
+            cmds.undoInfo(openChunk=True, chunkName="scatter_fx")
+            scatter = self.set_scatter.iter_scatter(object_to_instance, points,
+                                                    self.backend)
+            try:
+                for created in scatter:
+                    self.progress_bar.setValue(created)
+                    QtWidgets.QApplication.processEvents()
+                    if self.scatter_cancelled:
+                        log.info("Scatter cancelled after %d of %d points.",
+                                 created, len(points.positions))
+                        break
+            finally:
+                scatter.close()
+                cmds.undoInfo(closeChunk=True)
+                self.set_running(False)
+                timing.log_report(log)
+            if self.set_scatter.reject_overlaps:
+                log.info("Rejected %d overlapping instances.", points.rejected)
+                self.progress_bar.setFormat("%%p%% - %d overlapping rejected"
+                                            % points.rejected)
 
         else:
             print("Please ensure the first object you select is a transform")
 
+    def run_queue(self):
+        """Run the queued jobs in one undo chunk, sharing their mesh queries"""
+        job_count = len(self.scatter_queue.jobs)
+        self.progress_bar.setValue(0)
+        self.scatter_cancelled = False
+        self.set_running(True)
+        cmds.undoInfo(openChunk=True, chunkName="scatter_queue")
+        scatter = self.scatter_queue.iter_run(self.backend)
+        try:
+            for number, processed, total in scatter:
+                self.progress_bar.setRange(0, max(total, 1))
+                self.progress_bar.setValue(processed)
+                self.progress_bar.setFormat("Job %d of %d - %%p%%"
+                                            % (number + 1, job_count))
+                QtWidgets.QApplication.processEvents()
+                if self.scatter_cancelled:
+                    log.info("Scatter queue cancelled in job %d of %d.",
+                             number + 1, job_count)
+                    break
+        finally:
+            scatter.close()
+            cmds.undoInfo(closeChunk=True)
+            self.set_running(False)
+            timing.log_report(log)
+
     def randomize_values(self):
         self.set_scatter.density_percentage = random.uniform(0, 100)
         self.set_scatter.scale_min = random.uniform(0.0, 0.5)
@@ -287,16 +566,3 @@ class ScatterToolUI(QtWidgets.QDialog):
         self.rot_ymax_box.setValue(self.set_scatter.rot_y_max)
         self.rot_zmax_box.setValue(self.set_scatter.rot_z_max)
 
-
-class ScatterFX(object):
-    """Scatter Effect Default Values"""
-    def __init__(self, path=None):
-        self.density_percentage = 100
-        self.scale_max = 1.0
-        self.scale_min = 0.0
-        self.rot_x_min = 0.0
-        self.rot_y_min = 0.0
-        self.rot_z_min = 0.0
-        self.rot_x_max = 360.0
-        self.rot_y_max = 360.0
-        self.rot_z_max = 360.0
@@ -0,0 +1,104 @@
+"""Run scatter jobs headless under mayapy.
+
+Opens a scene, runs the scatter jobs of one or more preset files saved from
+the Scatter Tool and saves the result, without loading the Maya UI::
+
+    mayapy scatter_batch.py set_dressing.json --scene set_v001.ma --output set_v002.ma
+    mayapy scatter_batch.py rocks.json trees.json --scene set_v001.ma --in-place
+
+Jobs of every preset run in one queue, so targets shared between the jobs
+are only queried once.
+"""
+import os
+import logging
+import argparse
+
+import scatter_core
+import smartsave_core
+import timing
+
+
+log = logging.getLogger(__name__)
+
+
+def load_queue(paths, workers=None):
+    """Return a queue holding the jobs of every preset file.
+
+    Args:
+        paths (list): Preset files, their jobs queued in order
+        workers (int): Worker processes of every job, as saved by default
+    """
+    queue = scatter_core.ScatterQueue()
+    for path in paths:
+        for job in scatter_core.ScatterQueue.load(path).jobs:
+            if workers:
+                job.settings["workers"] = workers
+            queue.add(job)
+    return queue
+
+
+def run_batch(queue, scene=None, output=None):
+    """Scatter the jobs of queue into a scene in mayapy.
+
+    Args:
+        queue (ScatterQueue): Jobs to run
+        scene (str): Scene to open first, the empty scene by default
+        output (str): Path to save the scene to, not saved by default
+
+    Returns:
+        list: The number of nodes created by every job
+    """
+    import maya.standalone
+    maya.standalone.initialize(name="python")
+    import maya.cmds as cmds
+    from scatter_maya import MayaBackend
+
+    if scene:
+        cmds.file(scene, open=True, force=True, prompt=False)
+    backend = MayaBackend()
+    job_number = None
+    for number, processed, total in queue.iter_run(backend):
+        if number != job_number:
+            job_number = number
+            log.info("Job %d of %d: %d points", number + 1, len(queue.jobs), total)
+    for number, job in enumerate(queue.jobs):
+        log.info("Job %d created %d nodes, rejected %d overlapping",
+                 number + 1, len(job.nodes), job.rejected)
+    if output:
+        cmds.file(rename=output)
+        scene_type = smartsave_core.SCENE_TYPES.get(os.path.splitext(output)[1],
+                                                    "mayaAscii")
+        cmds.file(save=True, force=True, type=scene_type)
+        log.info("Saved %s", output)
+    return [len(job.nodes) for job in queue.jobs]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("jobs", nargs="+", help="scatter job preset files")
+    parser.add_argument("--scene", help="scene to open before scattering")
+    parser.add_argument("--output", help="path to save the scattered scene to")
+    parser.add_argument("--in-place", action="store_true",
+                        help="save over the opened scene")
+    parser.add_argument("--workers", type=int,
+                        help="worker processes of every job, as saved by default")
+    parser.add_argument("--timing", action="store_true",
+                        help="log the time spent in every scatter stage")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    if args.in_place:
+        if not args.scene:
+            parser.error("--in-place needs --scene")
+        args.output = args.scene
+    if args.timing:
+        timing.enable()
+    try:
+        queue = load_queue(args.jobs, args.workers)
+    except (IOError, ValueError, KeyError) as err:
+        parser.error("could not load scatter jobs: %s" % err)
+    run_batch(queue, args.scene, args.output)
+    timing.log_report(log)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""Headless benchmarks for the Scatter Tool core.
+
+Times the sampling, geometry query, normal alignment and transform stages
+of ScatterFX against a stand-in terrain mesh, so performance regressions
+can be caught without Maya::
+
+    python scatter_bench.py --points 10000 100000 1000000
+
+Save the timings with --save-baseline and pass them back with --baseline to
+exit with status 1 when a stage gets slower than the baseline by more than
+--tolerance::
+
+    python scatter_bench.py --points 100000 --save-baseline bench.json
+    python scatter_bench.py --points 100000 --baseline bench.json
+"""
+import argparse
+import json
+import logging
+import math
+import timeit
+
+import scatter_core
+
+
+log = logging.getLogger(__name__)
+
+DEFAULT_POINTS = (10000, 100000, 1000000)
+DEFAULT_TOLERANCE = 0.25
+MIN_REGRESSION_SECONDS = 0.01
+
+
+def time_stage(func, *args):
+    """Return the run time in seconds and the result of a call."""
+    start = timeit.default_timer()
+    result = func(*args)
+    return timeit.default_timer() - start, result
+
+
+def run_benchmark(point_count, density_percentage=50.0, seed=1):
+    """Time every scatter stage for a terrain of about point_count vertices.
+
+    Args:
+        point_count (int): Number of vertices of the stand-in terrain
+        density_percentage (float): Density used by the sampling stage
+        seed (int): Seed of the scatter, so runs are comparable
+
+    Returns:
+        list: (stage, points, seconds) tuples
+    """
+    backend = scatter_core.InMemoryBackend()
+    resolution = int(math.ceil(math.sqrt(point_count)))
+    indices = backend.add_terrain("terrain", resolution, colours=False)
+    scatter_fx = scatter_core.ScatterFX()
+    scatter_fx.density_percentage = density_percentage
+    scatter_fx.seed = seed
+    vertices = [("terrain", index) for index in indices]
+    rng = scatter_core.make_rng(seed)
+
+    results = []
+    seconds, sampled = time_stage(scatter_fx.sample, [("terrain", indices)],
+                                  backend)
+    results.append(("sample", len(indices), seconds))
+    seconds, (positions, normals) = time_stage(scatter_fx.query, vertices,
+                                               backend)
+    results.append(("query", len(vertices), seconds))
+    seconds, _ = time_stage(scatter_core.align_rows, normals,
+                            scatter_fx.up_axis)
+    results.append(("align", len(normals), seconds))
+    seconds, _ = time_stage(scatter_fx.transforms, positions, normals, rng)
+    results.append(("transforms", len(positions), seconds))
+    return results
+
+
+def format_results(results):
+    """Return the benchmark results as a text table."""
+    lines = ["%-12s %10s %10s %14s" % ("stage", "points", "seconds", "points/sec")]
+    for stage, points, seconds in results:
+        rate = points / seconds if seconds else float("inf")
+        lines.append("%-12s %10d %10.3f %14.0f" % (stage, points, seconds, rate))
+    return "\n".join(lines)
+
+
+def save_baseline(path, all_results):
+    """Write {point count: {stage: seconds}} for every benchmark to path."""
+    baseline = dict((str(point_count),
+                     dict((stage, seconds) for stage, _, seconds in results))
+                    for point_count, results in all_results.items())
+    with open(path, "w") as baseline_file:
+        json.dump(baseline, baseline_file, indent=4, sort_keys=True)
+
+
+def load_baseline(path):
+    """Read a baseline written by save_baseline."""
+    with open(path) as baseline_file:
+        return json.load(baseline_file)
+
+
+def find_regressions(point_count, results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Return the stages slower than the baseline by more than tolerance.
+
+    Stages less than MIN_REGRESSION_SECONDS slower are never reported, so
+    timer noise on tiny runs does not fail the benchmark.
+
+    Args:
+        point_count (int): Terrain vertex count the results were run with
+        results (list): (stage, points, seconds) tuples of run_benchmark
+        baseline (dict): Baseline read with load_baseline
+        tolerance (float): Allowed slowdown, 0.25 for 25% slower
+
+    Returns:
+        list: (stage, seconds, baseline seconds) tuples
+    """
+    stages = baseline.get(str(point_count), {})
+    regressions = []
+    for stage, _, seconds in results:
+        if stage not in stages:
+            continue
+        allowed = stages[stage] * (1.0 + tolerance)
+        if seconds > allowed and seconds - stages[stage] > MIN_REGRESSION_SECONDS:
+            regressions.append((stage, seconds, stages[stage]))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--points", type=int, nargs="+", default=DEFAULT_POINTS,
+                        help="terrain vertex counts to benchmark")
+    parser.add_argument("--density", type=float, default=50.0,
+                        help="density percentage of the sampling stage")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--baseline",
+                        help="fail if a stage is slower than in this file")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="allowed slowdown against the baseline, 0.25 "
+                             "for 25%% slower")
+    parser.add_argument("--save-baseline",
+                        help="write the timings to this file")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    baseline = load_baseline(args.baseline) if args.baseline else None
+    all_results = {}
+    regressions = []
+    for point_count in args.points:
+        log.info("%d points", point_count)
+        results = run_benchmark(point_count, args.density, args.seed)
+        all_results[point_count] = results
+        log.info(format_results(results))
+        if baseline is not None:
+            for stage, seconds, baseline_seconds in find_regressions(
+                    point_count, results, baseline, args.tolerance):
+                log.error("%d points: %s took %.3fs against %.3fs in the "
+                          "baseline", point_count, stage, seconds,
+                          baseline_seconds)
+                regressions.append(stage)
+    if args.save_baseline:
+        save_baseline(args.save_baseline, all_results)
+    if regressions:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1433 @@
+"""Maya independent core of the Scatter Tool.
+
+ScatterFX and the functions in this module only work on plain Python
+sequences and reach the scene through a MeshBackend, so the scatter effect
+can be computed, tested and timed without a Maya session. Matrices follow
+the Maya row-vector convention and are returned as flat 16 float tuples
+ready for ``cmds.xform(matrix=...)``.
+"""
+import bisect
+import collections
+import copy
+import itertools
+import json
+import math
+import multiprocessing
+import random
+
+import timing
+
+try:
+    range = xrange
+    string_types = basestring
+except NameError:
+    string_types = str
+
+
+EPSILON = 1e-8
+UP_AXES = {"x": (1.0, 0.0, 0.0), "y": (0.0, 1.0, 0.0), "z": (0.0, 0.0, 1.0)}
+FALLBACK_AXES = {"x": "y", "y": "z", "z": "x"}
+CHUNK_SIZE = 10000
+SURFACE_ATTEMPTS = 30
+SURFACE_MIN_ACCEPTANCE = 0.01
+SAMPLING_SETTINGS = ("density_percentage", "seed", "min_distance",
+                     "density_source", "density_map", "distribution",
+                     "point_count")
+
+
+def make_rng(seed=0):
+    """Return a random number generator, seeded unless the seed is 0."""
+    return random.Random(seed or None)
+
+
+def chunk_rng(seed, chunk_number):
+    """Return the random number generator of one chunk of a seeded scatter.
+
+    Every chunk gets its own stream so chunks can be generated in any order
+    or process and still give the same values.
+    """
+    return random.Random("scatter:%d:%d" % (seed, chunk_number))
+
+
+def sample_indices(count, density_percentage, rng=random, weights=None):
+    """Pick a random subset of point indices.
+
+    Without weights exactly the requested percentage of the points is
+    picked. With weights every point is kept with a probability of the
+    density scaled by its weight, so darker areas of a density map receive
+    fewer points.
+
+    Args:
+        count (int): Number of candidate points
+        density_percentage (float): Percentage of the points to keep
+        rng (random.Random): Random number generator to sample with
+        weights (list): Optional 0-1 density weight of every point
+
+    Returns:
+        list: The sampled indices in ascending order
+    """
+    if weights is not None:
+        threshold = density_percentage / 100.0
+        return [index for index, weight in enumerate(weights)
+                if rng.random() < threshold * weight]
+    number_of_points = int(count * density_percentage / 100)
+    # Mark the smaller of the picked and dropped sets in a byte mask so the
+    # random draws never exceed half of the points.
+    invert = number_of_points > count // 2
+    mask = bytearray(b"\x01" * count if invert else count)
+    remaining = count - number_of_points if invert else number_of_points
+    mark = 0 if invert else 1
+    random_float = rng.random
+    while remaining:
+        for index in [int(random_float() * count) for _ in range(remaining)]:
+            if mask[index] != mark:
+                mask[index] = mark
+                remaining -= 1
+    return list(itertools.compress(range(count), mask))
+
+
+def thin_by_distance(positions, min_distance, rng=random):
+    """Drop points until no two remaining points are closer than min_distance.
+
+    Points are visited in random order and kept when no kept point lies
+    within the minimum distance, which gives a Poisson disk like spread.
+
+    Args:
+        positions (list): (x, y, z) positions of the candidate points
+        min_distance (float): Minimum distance between two kept points
+        rng (random.Random): Random number generator to pick the visit order
+
+    Returns:
+        list: Indices of the kept positions in ascending order
+    """
+    grid = SpatialHash(min_distance)
+    order = list(range(len(positions)))
+    rng.shuffle(order)
+    kept = []
+    for index in order:
+        position = positions[index]
+        if not grid.has_neighbour(position, min_distance):
+            grid.insert(position)
+            kept.append(index)
+    kept.sort()
+    return kept
+
+
+class SurfaceSampler(object):
+    """Random points spread uniformly by area over the triangles of meshes.
+
+    A cumulative area table over every triangle picks the triangle of a
+    point with a binary search, and the point and its normal are then
+    interpolated from random barycentric coordinates.
+    """
+
+    def __init__(self):
+        self.points = []
+        self.normals = []
+        self.corners = []
+        self.cumulative = []
+        self.total = 0.0
+
+    def add_mesh(self, points, normals, triangles, weights=None):
+        """Add the triangles of a mesh.
+
+        Args:
+            points (list): (x, y, z) world position of every vertex
+            normals (list): (x, y, z) world normal of every vertex
+            triangles (list): Flat vertex indices, three per triangle
+            weights (dict): Optional 0-1 density weight per vertex index.
+                Triangles with a vertex missing from it are left out and the
+                area of the others is scaled by their average weight.
+        """
+        offset = len(self.points)
+        self.points.extend(points)
+        self.normals.extend(normals)
+        corners = self.corners
+        cumulative = self.cumulative
+        total = self.total
+        for corner in range(0, len(triangles), 3):
+            a, b, c = triangles[corner:corner + 3]
+            if weights is not None:
+                if a not in weights or b not in weights or c not in weights:
+                    continue
+                weight = (weights[a] + weights[b] + weights[c]) / 3.0
+            else:
+                weight = 1.0
+            pa, pb, pc = points[a], points[b], points[c]
+            area = 0.5 * _length(_cross(
+                (pb[0] - pa[0], pb[1] - pa[1], pb[2] - pa[2]),
+                (pc[0] - pa[0], pc[1] - pa[1], pc[2] - pa[2]))) * weight
+            if area <= 0.0:
+                continue
+            total += area
+            cumulative.append(total)
+            corners.extend((a + offset, b + offset, c + offset))
+        self.total = total
+
+    def sample(self, count, rng=random):
+        """Return the positions and normals of count random surface points.
+
+        Returns:
+            tuple: A list of (x, y, z) positions and a list of (x, y, z)
+                normals
+        """
+        positions, coordinates = self.sample_positions(count, rng)
+        return positions, self.interpolate_normals(coordinates)
+
+    def sample_positions(self, count, rng=random):
+        """Return the positions of count random surface points.
+
+        The normals are left to interpolate_normals, so callers rejecting
+        most of the points only pay for the normals of the ones they keep.
+
+        Returns:
+            tuple: A list of (x, y, z) positions and a list of the
+                (corner, u, v) barycentric coordinates of every point
+        """
+        points = self.points
+        corners = self.corners
+        cumulative = self.cumulative
+        total = self.total
+        random_float = rng.random
+        search = bisect.bisect_left
+        triangles = [3 * search(cumulative, random_float() * total)
+                     for _ in range(count)]
+        positions = []
+        coordinates = []
+        for corner in triangles:
+            u = random_float()
+            v = random_float()
+            if u + v > 1.0:
+                u = 1.0 - u
+                v = 1.0 - v
+            w = 1.0 - u - v
+            pa = points[corners[corner]]
+            pb = points[corners[corner + 1]]
+            pc = points[corners[corner + 2]]
+            positions.append((w * pa[0] + u * pb[0] + v * pc[0],
+                              w * pa[1] + u * pb[1] + v * pc[1],
+                              w * pa[2] + u * pb[2] + v * pc[2]))
+            coordinates.append((corner, u, v))
+        return positions, coordinates
+
+    def interpolate_normals(self, coordinates):
+        """Return the unit normals at (corner, u, v) barycentric coordinates."""
+        normals = self.normals
+        corners = self.corners
+        point_normals = []
+        for corner, u, v in coordinates:
+            w = 1.0 - u - v
+            na = normals[corners[corner]]
+            nb = normals[corners[corner + 1]]
+            nc = normals[corners[corner + 2]]
+            x = w * na[0] + u * nb[0] + v * nc[0]
+            y = w * na[1] + u * nb[1] + v * nc[1]
+            z = w * na[2] + u * nb[2] + v * nc[2]
+            length = math.sqrt(x * x + y * y + z * z)
+            if length > EPSILON:
+                point_normals.append((x / length, y / length, z / length))
+            else:
+                point_normals.append((x, y, z))
+        return point_normals
+
+
+def random_transforms(count, scatter_fx, rng=random):
+    """Generate a random rotation and uniform scale for every point.
+
+    Args:
+        count (int): Number of points to generate values for
+        scatter_fx (ScatterFX): Settings holding the rotation and scale ranges
+        rng (random.Random): Random number generator to draw values from
+
+    Returns:
+        tuple: A list of (x, y, z) rotations in degrees and a list of scales
+    """
+    rotations = []
+    scales = []
+    for _ in range(count):
+        rotations.append((rng.uniform(scatter_fx.rot_x_min, scatter_fx.rot_x_max),
+                          rng.uniform(scatter_fx.rot_y_min, scatter_fx.rot_y_max),
+                          rng.uniform(scatter_fx.rot_z_min, scatter_fx.rot_z_max)))
+        scales.append(rng.uniform(scatter_fx.scale_min, scatter_fx.scale_max))
+    return rotations, scales
+
+
+def euler_to_rows(rotation):
+    """Return the 3x3 rotation rows for an xyz euler rotation in degrees."""
+    rx, ry, rz = [math.radians(angle) for angle in rotation]
+    cx, sx = math.cos(rx), math.sin(rx)
+    cy, sy = math.cos(ry), math.sin(ry)
+    cz, sz = math.cos(rz), math.sin(rz)
+    return ((cy * cz, cy * sz, -sy),
+            (sx * sy * cz - cx * sz, sx * sy * sz + cx * cz, sx * cy),
+            (cx * sy * cz + sx * sz, cx * sy * sz - sx * cz, cx * cy))
+
+
+def align_rows(normals, up_axis="y"):
+    """Return the 3x3 rotation rows that point the Y axis along each normal.
+
+    The tangent frame is built from the normal and the world up axis. When a
+    normal is parallel to the up axis the next world axis is used instead so
+    the result never contains NaNs. Zero length normals keep the world frame.
+
+    Args:
+        normals (list): (x, y, z) normals
+        up_axis (str): World axis used as the reference up vector, "x", "y"
+            or "z"
+
+    Returns:
+        list: One ((x, y, z), (x, y, z), (x, y, z)) rotation per normal
+    """
+    up_vector = UP_AXES[up_axis.lower()]
+    fallback_vector = UP_AXES[FALLBACK_AXES[up_axis.lower()]]
+    identity = (UP_AXES["x"], UP_AXES["y"], UP_AXES["z"])
+    all_rows = []
+    for normal in normals:
+        length = _length(normal)
+        if length < EPSILON:
+            all_rows.append(identity)
+            continue
+        normal = (normal[0] / length, normal[1] / length, normal[2] / length)
+        tangent = _cross(normal, up_vector)
+        if _length(tangent) < EPSILON:
+            tangent = _cross(normal, fallback_vector)
+        tangent = _normalize(tangent)
+        tangent2 = _cross(normal, tangent)
+        all_rows.append((tangent2, normal, tangent))
+    return all_rows
+
+
+def align_matrices(positions, normals, up_axis="y"):
+    """Return world matrices aligning the Y axis of each point to its normal.
+
+    Args:
+        positions (list): (x, y, z) world positions
+        normals (list): (x, y, z) world normals
+        up_axis (str): World axis used as the reference up vector
+
+    Returns:
+        list: Flat 16 float world matrices, one per position
+    """
+    matrices = []
+    for rows, position in zip(align_rows(normals, up_axis), positions):
+        matrices.append(rows[0] + (0.0,) + rows[1] + (0.0,) + rows[2] + (0.0,) +
+                        (position[0], position[1], position[2], 1.0))
+    return matrices
+
+
+def build_matrices(positions, rotations, scales, normals=None, up_axis="y"):
+    """Compose the final world matrix of every scattered instance.
+
+    Each instance is scaled, optionally aligned to its normal, rotated by its
+    random rotation in world space and finally moved to its position.
+
+    Args:
+        positions (list): (x, y, z) world positions
+        rotations (list): (x, y, z) euler rotations in degrees
+        scales (list): Uniform scale values
+        normals (list): (x, y, z) world normals to align to, or None
+        up_axis (str): World axis used as the reference up vector when
+            aligning to normals
+
+    Returns:
+        list: Flat 16 float world matrices, one per position
+    """
+    if normals is not None:
+        alignments = align_rows(normals, up_axis)
+    matrices = []
+    for index, position in enumerate(positions):
+        rows = euler_to_rows(rotations[index])
+        if normals is not None:
+            rows = _multiply_rows(alignments[index], rows)
+        scale = scales[index]
+        matrix = []
+        for row in rows:
+            matrix.extend((row[0] * scale, row[1] * scale, row[2] * scale, 0.0))
+        matrix.extend((position[0], position[1], position[2], 1.0))
+        matrices.append(tuple(matrix))
+    return matrices
+
+
+def rows_to_euler(rows):
+    """Return the xyz euler rotation in degrees of 3x3 rotation rows."""
+    sin_y = max(-1.0, min(1.0, -rows[0][2]))
+    if abs(sin_y) < 1.0 - EPSILON:
+        rx = math.atan2(rows[1][2], rows[2][2])
+        rz = math.atan2(rows[0][1], rows[0][0])
+    else:
+        rx = math.atan2(-rows[2][1], rows[1][1])
+        rz = 0.0
+    return math.degrees(rx), math.degrees(math.asin(sin_y)), math.degrees(rz)
+
+
+def decompose_matrices(matrices):
+    """Split uniformly scaled world matrices back into their components.
+
+    Args:
+        matrices (list): Flat 16 float world matrices
+
+    Returns:
+        tuple: Lists of (x, y, z) positions, (x, y, z) euler rotations in
+            degrees and uniform scales
+    """
+    positions = []
+    rotations = []
+    scales = []
+    for matrix in matrices:
+        scale = _length(matrix[0:3])
+        if scale < EPSILON:
+            rotation = (0.0, 0.0, 0.0)
+        else:
+            rotation = rows_to_euler((_scaled(matrix[0:3], 1.0 / scale),
+                                      _scaled(matrix[4:7], 1.0 / scale),
+                                      _scaled(matrix[8:11], 1.0 / scale)))
+        positions.append(tuple(matrix[12:15]))
+        rotations.append(rotation)
+        scales.append(scale)
+    return positions, rotations, scales
+
+
+class ScatterFX(object):
+    """Scatter effect settings and the scatter algorithm itself.
+
+    The algorithm only talks to the scene through a MeshBackend so it can
+    run against the Maya scene or an InMemoryBackend alike.
+    """
+    def __init__(self, path=None):
+        self.density_percentage = 100
+        self.scale_max = 1.0
+        self.scale_min = 0.0
+        self.rot_x_min = 0.0
+        self.rot_y_min = 0.0
+        self.rot_z_min = 0.0
+        self.rot_x_max = 360.0
+        self.rot_y_max = 360.0
+        self.rot_z_max = 360.0
+        self.align_to_normal = True
+        self.up_axis = "y"
+        self.output_mode = "instances"
+        self.seed = 0
+        self.workers = 1
+        self.min_distance = 0.0
+        self.density_source = "none"
+        self.density_map = ""
+        self.distribution = "vertices"
+        self.point_count = 1000
+        self.reject_overlaps = False
+        self.overlap_padding = 0.0
+
+    def settings(self):
+        """Return every setting as a dict of plain values."""
+        return dict(vars(self))
+
+    def apply_settings(self, settings):
+        """Set the settings found in a dict, leaving the others untouched.
+
+        Raises:
+            ValueError: If a setting does not exist
+        """
+        for name, value in settings.items():
+            if not hasattr(self, name):
+                raise ValueError("Unknown scatter setting %s" % name)
+            setattr(self, name, value)
+
+    def sample(self, vertices, backend, geometry=None):
+        """Randomly pick a percentage of the candidate vertices.
+
+        The density can be weighted by the vertex colours or a texture and
+        the sampled vertices thinned out to a minimum distance.
+
+        Args:
+            vertices (list): (mesh, vertex indices) pairs to pick from
+            backend (MeshBackend): Scene the meshes live in
+            geometry (dict): Cache of mesh points and normals
+
+        Returns:
+            list: The sampled (mesh, vertex index) pairs
+        """
+        rng = make_rng(self.seed)
+        weights = None
+        if self.density_source == "vertex colour":
+            weights = []
+            for mesh, indices in vertices:
+                weights.extend(backend.vertex_colour_weights(mesh, indices))
+        elif self.density_source == "texture":
+            weights = []
+            for mesh, indices in vertices:
+                weights.extend(backend.texture_weights(mesh, indices,
+                                                       self.density_map))
+        total = sum(len(indices) for _, indices in vertices)
+        samples = sample_indices(total, self.density_percentage, rng, weights)
+        sampled_vertices = []
+        offset = 0
+        mesh_number = 0
+        for sample in samples:
+            while sample >= offset + len(vertices[mesh_number][1]):
+                offset += len(vertices[mesh_number][1])
+                mesh_number += 1
+            mesh, indices = vertices[mesh_number]
+            sampled_vertices.append((mesh, indices[sample - offset]))
+        if self.min_distance > 0:
+            positions, _ = self.query(sampled_vertices, backend, geometry)
+            kept = thin_by_distance(positions, self.min_distance, rng)
+            sampled_vertices = [sampled_vertices[index] for index in kept]
+        return sampled_vertices
+
+    def sample_surface(self, vertices, backend):
+        """Spread point_count points uniformly by area over the selection.
+
+        Every triangle with all three vertices selected is part of the
+        surface. The density source weights the area of the triangles and
+        points closer than min_distance to an earlier point are rejected
+        through a spatial hash, so fewer points are returned when the
+        spacing does not leave room for all of them.
+
+        Args:
+            vertices (list): (mesh, vertex indices) pairs outlining the surface
+            backend (MeshBackend): Scene the meshes live in
+
+        Returns:
+            tuple: A list of (x, y, z) positions and a list of (x, y, z)
+                normals
+        """
+        rng = make_rng(self.seed)
+        sampler = SurfaceSampler()
+        for mesh, indices in vertices:
+            if self.density_source == "vertex colour":
+                weights = backend.vertex_colour_weights(mesh, indices)
+            elif self.density_source == "texture":
+                weights = backend.texture_weights(mesh, indices, self.density_map)
+            else:
+                weights = itertools.repeat(1.0)
+            points, normals = backend.mesh_geometry(mesh)
+            sampler.add_mesh(points, normals, backend.mesh_triangles(mesh),
+                             dict(zip(indices, weights)))
+        if not sampler.total:
+            return [], []
+        if self.min_distance <= 0:
+            return sampler.sample(self.point_count, rng)
+        # Candidates are drawn in batches and kept when no kept point lies
+        # within the minimum distance, until enough are kept, the attempts
+        # run out or a batch keeps (almost) none, as the surface is then
+        # close to full and further batches would only add a few points.
+        grid = SpatialHash(2.0 * self.min_distance)
+        add = grid.insert_if_clear
+        min_distance = self.min_distance
+        point_count = self.point_count
+        positions = []
+        coordinates = []
+        attempts = point_count * SURFACE_ATTEMPTS
+        while len(positions) < point_count and attempts > 0:
+            batch = min(CHUNK_SIZE, attempts)
+            attempts -= batch
+            kept = len(positions)
+            candidates, candidate_coordinates = sampler.sample_positions(batch, rng)
+            for position, coordinate in zip(candidates, candidate_coordinates):
+                if add(position, min_distance):
+                    positions.append(position)
+                    coordinates.append(coordinate)
+                    if len(positions) == point_count:
+                        break
+            if len(positions) - kept < max(1, batch * SURFACE_MIN_ACCEPTANCE):
+                break
+        return positions, sampler.interpolate_normals(coordinates)
+
+    def query(self, vertices, backend, geometry=None):
+        """Return the world positions and normals of the given vertices.
+
+        Every mesh is queried from the backend once and kept in geometry.
+
+        Args:
+            vertices (list): (mesh, vertex index) pairs
+            backend (MeshBackend): Scene the meshes live in
+            geometry (dict): Cache of mesh points and normals
+
+        Returns:
+            tuple: A list of (x, y, z) positions and a list of (x, y, z)
+                normals
+        """
+        if geometry is None:
+            geometry = {}
+        with timing.span("scatter.geometry"):
+            for mesh in set(mesh for mesh, _ in vertices) - set(geometry):
+                geometry[mesh] = backend.mesh_geometry(mesh)
+        positions = []
+        normals = []
+        for mesh, index in vertices:
+            points, vertex_normals = geometry[mesh]
+            point = points[index]
+            normal = vertex_normals[index]
+            positions.append((point[0], point[1], point[2]))
+            normals.append((normal[0], normal[1], normal[2]))
+        return positions, normals
+
+    def transforms(self, positions, normals, rng=random):
+        """Return the world matrix of an instance at every position.
+
+        Args:
+            positions (list): (x, y, z) world positions
+            normals (list): (x, y, z) world normals
+            rng (random.Random): Random number generator for the rotations
+                and scales
+
+        Returns:
+            list: Flat 16 float world matrices, one per position
+        """
+        rotations, scales = random_transforms(len(positions), self, rng)
+        if not self.align_to_normal:
+            normals = None
+        return build_matrices(positions, rotations, scales, normals,
+                              self.up_axis)
+
+    def sample_points(self, vertices, backend, cache=None):
+        """Sample the vertices and query their positions and normals.
+
+        With a cache the result is reused for as long as the meshes, the
+        selection and the sampling settings stay the same.
+
+        Args:
+            vertices (list): (mesh, vertex indices) pairs to pick from
+            backend (MeshBackend): Scene the meshes live in
+            cache (ScatterCache): Cache of previously sampled points
+
+        Returns:
+            ScatterPoints: The sampled points
+        """
+        if cache is not None:
+            key = cache.key(self, vertices, backend)
+            points = cache.get(key)
+            if points is not None:
+                timing.count("scatter.cache_hits")
+                return points
+        geometry = {}
+        if self.distribution == "surface":
+            sampled_vertices = []
+            with timing.span("scatter.sample_surface"):
+                positions, normals = self.sample_surface(vertices, backend)
+        else:
+            with timing.span("scatter.sample"):
+                sampled_vertices = self.sample(vertices, backend, geometry)
+            with timing.span("scatter.query"):
+                positions, normals = self.query(sampled_vertices, backend, geometry)
+        timing.count("scatter.points", len(positions))
+        points = ScatterPoints(sampled_vertices, positions, normals)
+        if cache is not None:
+            cache.put(key, points)
+        return points
+
+    def iter_scatter(self, source, points, backend, overlaps=None):
+        """Scatter instances of source onto points one chunk at a time.
+
+        If the points were already fully scattered with the same source and
+        output mode and those nodes still exist, the nodes are moved in
+        place instead of being created again. In "instancer" output mode the
+        matrices are collected and written to a single instancer once the
+        generator finishes or is closed. With reject_overlaps on, instances
+        whose bounding sphere, grown by overlap_padding, touches an instance
+        placed before them are dropped and counted in points.rejected.
+
+        Args:
+            source (str): Object to instance
+            points (ScatterPoints): Points to scatter onto
+            backend (MeshBackend): Scene to create or update the nodes in
+            overlaps (OverlapGrid): Instances placed by earlier scatters to
+                keep clear of, a new grid by default
+
+        Yields:
+            int: The number of points processed so far
+        """
+        update = (not self.reject_overlaps and
+                  points.source == source and
+                  points.output_mode == self.output_mode and
+                  points.scattered == len(points.positions) and
+                  backend.nodes_exist(points.nodes))
+        if not update:
+            points.source = source
+            points.output_mode = self.output_mode
+            points.nodes = []
+            points.scattered = 0
+        points.rejected = 0
+        if self.reject_overlaps:
+            center, radius = backend.bounding_sphere(source)
+            if overlaps is None:
+                overlaps = OverlapGrid(radius * self.max_scale(),
+                                       self.overlap_padding)
+        else:
+            overlaps = None
+        transforms = self.iter_transforms(points.positions, points.normals)
+        created = 0
+        processed = 0
+        instancer_matrices = []
+        try:
+            for matrices in transforms:
+                processed += len(matrices)
+                if overlaps is not None:
+                    with timing.span("scatter.reject_overlaps"):
+                        kept = overlaps.place(matrices, center, radius)
+                    points.rejected += len(matrices) - len(kept)
+                    timing.count("scatter.rejected", len(matrices) - len(kept))
+                    matrices = kept
+                if self.output_mode == "instancer":
+                    instancer_matrices.extend(matrices)
+                elif update:
+                    with timing.span("scatter.write_transforms"):
+                        backend.set_matrices(
+                            points.nodes[created:created + len(matrices)], matrices)
+                else:
+                    with timing.span("scatter.create_instances"):
+                        points.nodes.extend(backend.create_instances(source, matrices))
+                    timing.count("scatter.instances", len(matrices))
+                    points.scattered += len(matrices)
+                created += len(matrices)
+                yield processed
+        finally:
+            transforms.close()
+            if update and instancer_matrices:
+                if len(instancer_matrices) == len(points.positions):
+                    with timing.span("scatter.write_transforms"):
+                        backend.update_instancer(points.nodes[0], instancer_matrices)
+            elif instancer_matrices:
+                with timing.span("scatter.create_instancer"):
+                    points.nodes = [backend.create_instancer(source,
+                                                             instancer_matrices)]
+                points.scattered = len(instancer_matrices)
+
+    def max_scale(self):
+        """Return the largest scale an instance can get."""
+        return max(self.scale_min, self.scale_max)
+
+    def iter_transforms(self, positions, normals):
+        """Yield the world matrices of the points one chunk at a time.
+
+        Each chunk draws from its own random stream derived from the seed,
+        so the matrices are identical whatever the number of workers. With
+        more than one worker the chunks are generated ahead in a process
+        pool while the caller consumes them.
+
+        Args:
+            positions (list): (x, y, z) world positions
+            normals (list): (x, y, z) world normals
+
+        Yields:
+            list: Flat 16 float world matrices of the next chunk
+        """
+        seed = self.seed or random.getrandbits(31)
+        tasks = []
+        for number, start in enumerate(range(0, len(positions), CHUNK_SIZE)):
+            tasks.append((self, positions[start:start + CHUNK_SIZE],
+                          normals[start:start + CHUNK_SIZE], seed, number))
+        if self.workers > 1 and len(tasks) > 1:
+            pool = multiprocessing.Pool(min(self.workers, len(tasks)))
+            try:
+                results = pool.imap(_chunk_transforms, tasks)
+                for _ in tasks:
+                    with timing.span("scatter.transforms"):
+                        matrices = next(results)
+                    yield matrices
+            finally:
+                pool.terminate()
+        else:
+            for task in tasks:
+                with timing.span("scatter.transforms"):
+                    matrices = _chunk_transforms(task)
+                yield matrices
+
+    def scatter(self, source, vertices, backend):
+        """Sample the vertices and scatter source onto them in one go.
+
+        Returns:
+            int: The number of points scattered
+        """
+        points = self.sample_points(vertices, backend)
+        processed = 0
+        for processed in self.iter_scatter(source, points, backend):
+            pass
+        return processed - points.rejected
+
+
+class ScatterPoints(object):
+    """Sampled scatter points and the nodes last scattered onto them."""
+
+    def __init__(self, vertices, positions, normals):
+        self.vertices = vertices
+        self.positions = positions
+        self.normals = normals
+        self.source = None
+        self.output_mode = None
+        self.nodes = []
+        self.scattered = 0
+        self.rejected = 0
+
+
+class OverlapGrid(object):
+    """Bounding spheres of placed instances in a uniform grid.
+
+    The cells are as wide as the largest possible sphere plus the padding,
+    so an overlap test only reads the cells next to the new sphere.
+    """
+
+    def __init__(self, max_radius, padding=0.0):
+        self.max_radius = max_radius
+        self.padding = padding
+        self.grid = SpatialHash(max(2.0 * max_radius + padding, EPSILON))
+
+    def overlaps(self, center, radius):
+        """Return True if a sphere touches a placed sphere or its padding."""
+        px, py, pz = center
+        for other, other_radius in self.grid.nearby(
+                center, radius + self.max_radius + self.padding):
+            limit = radius + other_radius + self.padding
+            dx = other[0] - px
+            dy = other[1] - py
+            dz = other[2] - pz
+            if dx * dx + dy * dy + dz * dz < limit * limit:
+                return True
+        return False
+
+    def insert(self, center, radius):
+        """Add a placed sphere."""
+        self.grid.insert(center, radius)
+
+    def place(self, matrices, center, radius):
+        """Place instances in order, dropping the ones that overlap.
+
+        Args:
+            matrices (list): Flat 16 float world matrices of the instances
+            center (tuple): Bounding sphere center in object space
+            radius (float): Bounding sphere radius in object space
+
+        Returns:
+            list: The matrices of the instances that were placed
+        """
+        kept = []
+        cx, cy, cz = center
+        for matrix in matrices:
+            world_center = (cx * matrix[0] + cy * matrix[4] + cz * matrix[8] + matrix[12],
+                            cx * matrix[1] + cy * matrix[5] + cz * matrix[9] + matrix[13],
+                            cx * matrix[2] + cy * matrix[6] + cz * matrix[10] + matrix[14])
+            world_radius = radius * _length(matrix[0:3])
+            if self.overlaps(world_center, world_radius):
+                continue
+            self.insert(world_center, world_radius)
+            kept.append(matrix)
+        return kept
+
+
+class ScatterCache(object):
+    """Least recently used cache of ScatterPoints.
+
+    Entries are keyed on the state of every selected mesh, the selected
+    vertex indices and the ScatterFX settings that affect sampling, so
+    rotation and scale changes reuse the cached points.
+    """
+
+    def __init__(self, max_entries=8):
+        self.max_entries = max_entries
+        self.entries = collections.OrderedDict()
+
+    def key(self, scatter_fx, vertices, backend):
+        """Return the cache key of sampling vertices with scatter_fx."""
+        selection = tuple((mesh, backend.mesh_hash(mesh), len(indices),
+                           hash(tuple(indices)))
+                          for mesh, indices in vertices)
+        settings = tuple(getattr(scatter_fx, name) for name in SAMPLING_SETTINGS)
+        return selection, settings
+
+    def get(self, key):
+        """Return the points stored under key, or None."""
+        points = self.entries.pop(key, None)
+        if points is not None:
+            self.entries[key] = points
+        return points
+
+    def put(self, key, points):
+        """Store points under key, evicting the least recently used entry."""
+        self.entries.pop(key, None)
+        self.entries[key] = points
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+
+
+class ScatterJob(object):
+    """Weighted source objects scattered onto target meshes.
+
+    Every sampled point gets one of the sources, picked at random in
+    proportion to its weight. Targets are mesh names, scattering onto every
+    vertex, or (mesh, vertex indices) pairs. The settings are those of
+    ScatterFX.settings(), the defaults filling in any that are missing.
+    """
+
+    def __init__(self, sources, targets, settings=None):
+        self.sources = [(source, 1.0) if isinstance(source, string_types)
+                        else (source[0], float(source[1]))
+                        for source in sources]
+        self.targets = [target if isinstance(target, string_types)
+                        else (target[0], list(target[1]))
+                        for target in targets]
+        self.settings = dict(settings or {})
+        self.nodes = []
+        self.rejected = 0
+
+    def to_dict(self):
+        return {"sources": [list(source) for source in self.sources],
+                "targets": [target if isinstance(target, string_types) else list(target)
+                            for target in self.targets],
+                "settings": self.settings}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["sources"], data["targets"], data.get("settings"))
+
+    def scatter_fx(self):
+        """Return a ScatterFX holding the settings of the job."""
+        scatter_fx = ScatterFX()
+        scatter_fx.apply_settings(self.settings)
+        return scatter_fx
+
+    def vertices(self, backend):
+        """Return the (mesh, vertex indices) pairs of the targets."""
+        vertices = []
+        for target in self.targets:
+            if isinstance(target, string_types):
+                points, _ = backend.mesh_geometry(target)
+                vertices.append((target, range(len(points))))
+            else:
+                vertices.append(target)
+        return vertices
+
+    def assign_sources(self, count, rng=random):
+        """Pick a source for each of count points in proportion to the weights.
+
+        Returns:
+            list: The indices of the points of each source
+
+        Raises:
+            ValueError: If there are no sources or no positive weights
+        """
+        cumulative = []
+        total = 0.0
+        for _, weight in self.sources:
+            total += max(0.0, weight)
+            cumulative.append(total)
+        if total <= 0.0:
+            raise ValueError("A scatter job needs a source with a positive weight")
+        assigned = [[] for _ in self.sources]
+        if len(self.sources) == 1:
+            assigned[0] = list(range(count))
+            return assigned
+        random_float = rng.random
+        search = bisect.bisect_right
+        last = len(cumulative) - 1
+        for index in range(count):
+            assigned[min(search(cumulative, random_float() * total), last)].append(index)
+        return assigned
+
+    def iter_run(self, backend):
+        """Sample the targets and scatter the sources onto them.
+
+        Every source draws its rotations and scales from its own seed, and
+        with reject_overlaps on all sources share one overlap grid so
+        instances of different sources keep clear of each other too. The
+        sources are placed in order, so the first ones win any overlaps.
+        The new nodes and rejected count are kept in nodes and rejected.
+
+        Args:
+            backend (MeshBackend): Scene to sample and create the nodes in
+
+        Yields:
+            tuple: The number of points processed so far and the total
+        """
+        scatter_fx = self.scatter_fx()
+        seed = scatter_fx.seed or random.getrandbits(31)
+        self.nodes = []
+        self.rejected = 0
+        points = scatter_fx.sample_points(self.vertices(backend), backend)
+        total = len(points.positions)
+        assigned = self.assign_sources(total, make_rng(seed))
+        overlaps = None
+        if scatter_fx.reject_overlaps:
+            max_radius = max(backend.bounding_sphere(source)[1]
+                             for source, _ in self.sources)
+            overlaps = OverlapGrid(max_radius * scatter_fx.max_scale(),
+                                   scatter_fx.overlap_padding)
+        done = 0
+        yield done, total
+        for number, ((source, _), indices) in enumerate(zip(self.sources, assigned)):
+            if not indices:
+                continue
+            source_fx = copy.copy(scatter_fx)
+            source_fx.seed = seed + number
+            source_points = ScatterPoints(
+                [], [points.positions[index] for index in indices],
+                [points.normals[index] for index in indices])
+            for processed in source_fx.iter_scatter(source, source_points,
+                                                    backend, overlaps):
+                yield done + processed, total
+            done += len(indices)
+            self.nodes.extend(source_points.nodes)
+            self.rejected += source_points.rejected
+
+
+class ScatterQueue(object):
+    """Scatter jobs run one after the other, saved and loaded as presets.
+
+    The jobs of a run share a CachedBackend, so a target mesh used by
+    several jobs is only queried once.
+    """
+
+    def __init__(self, jobs=None):
+        self.jobs = list(jobs or [])
+
+    def add(self, job):
+        self.jobs.append(job)
+
+    def clear(self):
+        del self.jobs[:]
+
+    def iter_run(self, backend):
+        """Run every job, yielding its progress.
+
+        Yields:
+            tuple: The job number, points processed and points of the job
+        """
+        cached_backend = CachedBackend(backend)
+        for number, job in enumerate(self.jobs):
+            with timing.span("scatter.job"):
+                for processed, total in job.iter_run(cached_backend):
+                    yield number, processed, total
+
+    def run(self, backend):
+        """Run every job in one go.
+
+        Returns:
+            list: The nodes created by every job
+        """
+        for _ in self.iter_run(backend):
+            pass
+        return [job.nodes for job in self.jobs]
+
+    def save(self, path):
+        """Write the jobs to a JSON preset file."""
+        with open(path, "w") as preset:
+            json.dump({"jobs": [job.to_dict() for job in self.jobs]}, preset,
+                      indent=2, sort_keys=True)
+
+    @classmethod
+    def load(cls, path):
+        """Return a queue holding the jobs of a JSON preset file."""
+        with open(path) as preset:
+            data = json.load(preset)
+        return cls(ScatterJob.from_dict(job) for job in data["jobs"])
+
+
+class MeshBackend(object):
+    """Access to the scene used by ScatterFX.
+
+    Meshes are referred to by name and vertices by their integer index.
+    """
+
+    def mesh_geometry(self, mesh):
+        """Return the world points and normals of every vertex of a mesh.
+
+        Returns:
+            tuple: Two sequences indexed by vertex holding (x, y, z) items
+        """
+        raise NotImplementedError
+
+    def mesh_hash(self, mesh):
+        """Return a value that changes when the mesh topology or shape does."""
+        raise NotImplementedError
+
+    def vertex_colour_weights(self, mesh, indices):
+        """Return the 0-1 vertex colour brightness of each vertex."""
+        raise NotImplementedError
+
+    def texture_weights(self, mesh, indices, texture):
+        """Return the 0-1 texture brightness at the UV of each vertex."""
+        raise NotImplementedError
+
+    def mesh_triangles(self, mesh):
+        """Return the vertex indices of the triangulated faces of a mesh.
+
+        Returns:
+            list: Flat vertex indices, three per triangle
+        """
+        raise NotImplementedError
+
+    def bounding_sphere(self, source):
+        """Return the object space bounding sphere of an object.
+
+        Returns:
+            tuple: The (x, y, z) center and the radius
+        """
+        raise NotImplementedError
+
+    def create_instances(self, source, matrices):
+        """Create one instance of source per world matrix.
+
+        Returns:
+            list: The names of the new instances
+        """
+        raise NotImplementedError
+
+    def create_instancer(self, source, matrices):
+        """Create a single instancer placing source at every world matrix.
+
+        Returns:
+            str: The name of the new instancer
+        """
+        raise NotImplementedError
+
+    def nodes_exist(self, nodes):
+        """Return True if there are nodes and all of them still exist."""
+        raise NotImplementedError
+
+    def set_matrices(self, nodes, matrices):
+        """Move existing instances to new world matrices."""
+        raise NotImplementedError
+
+    def update_instancer(self, instancer, matrices):
+        """Replace the world matrices of every point of an instancer."""
+        raise NotImplementedError
+
+
+class InMemoryBackend(MeshBackend):
+    """Stand-in scene keeping meshes and created instances in plain lists."""
+
+    def __init__(self):
+        self.meshes = {}
+        self.mesh_versions = {}
+        self.instances = []
+        self.instancers = []
+        self.bounds = {}
+        self.uvs = {}
+        self.textures = {}
+
+    def add_mesh(self, name, points, normals, colours=None, triangles=None,
+                 uvs=None):
+        """Add or replace a mesh from per vertex points, normals and colours.
+
+        Vertices without a (u, v) in uvs are unmapped and get no texture
+        weight, as in Maya.
+        """
+        self.meshes[name] = (points, normals, colours, triangles or [])
+        self.uvs[name] = uvs
+        self.mesh_versions[name] = self.mesh_versions.get(name, 0) + 1
+
+    def add_texture(self, name, pixels):
+        """Add or replace a texture from rows of 0-1 brightness values.
+
+        The first row is at v = 0 and the first value of a row at u = 0.
+        """
+        self.textures[name] = pixels
+
+    def add_terrain(self, name, resolution, size=100.0, height=5.0,
+                    colours=True):
+        """Add a rolling square terrain of resolution x resolution vertices.
+
+        The vertex colours, if added, get brighter with the height. The UVs
+        span the terrain once.
+
+        Returns:
+            list: The indices of every vertex of the new mesh
+        """
+        step = size / max(resolution - 1, 1)
+        triangles = []
+        for row in range(resolution - 1):
+            for column in range(resolution - 1):
+                corner = row * resolution + column
+                triangles.extend((corner, corner + resolution, corner + 1,
+                                  corner + 1, corner + resolution,
+                                  corner + resolution + 1))
+        frequency = 4.0 * math.pi / size
+        points = []
+        normals = []
+        uvs = []
+        vertex_colours = [] if colours else None
+        uv_step = 1.0 / max(resolution - 1, 1)
+        for row in range(resolution):
+            z = row * step
+            for column in range(resolution):
+                x = column * step
+                uvs.append((column * uv_step, row * uv_step))
+                y = height * math.sin(x * frequency) * math.cos(z * frequency)
+                slope_x = height * frequency * math.cos(x * frequency) * math.cos(z * frequency)
+                slope_z = -height * frequency * math.sin(x * frequency) * math.sin(z * frequency)
+                points.append((x, y, z))
+                normals.append(_normalize((-slope_x, 1.0, -slope_z)))
+                if colours:
+                    brightness = 0.5 + 0.5 * y / height
+                    vertex_colours.append((brightness, brightness, brightness))
+        self.add_mesh(name, points, normals, vertex_colours, triangles, uvs)
+        return range(len(points))
+
+    def mesh_geometry(self, mesh):
+        points, normals, _, _ = self.meshes[mesh]
+        return points, normals
+
+    def mesh_triangles(self, mesh):
+        return self.meshes[mesh][3]
+
+    def bounding_sphere(self, source):
+        return self.bounds.get(source, ((0.0, 0.0, 0.0), 0.5))
+
+    def mesh_hash(self, mesh):
+        return self.mesh_versions[mesh]
+
+    def vertex_colour_weights(self, mesh, indices):
+        colours = self.meshes[mesh][2]
+        if colours is None:
+            return [0.0] * len(indices)
+        return [max(0.0, sum(colours[index]) / 3.0) for index in indices]
+
+    def texture_weights(self, mesh, indices, texture):
+        """Return the brightness of the texture pixel under each vertex UV."""
+        uvs = self.uvs.get(mesh)
+        pixels = self.textures[texture]
+        if not uvs or not pixels:
+            return [0.0] * len(indices)
+        height = len(pixels)
+        width = len(pixels[0])
+        weights = []
+        for index in indices:
+            if index >= len(uvs) or uvs[index] is None:
+                weights.append(0.0)
+                continue
+            u, v = uvs[index]
+            row = pixels[min(max(int(v * height), 0), height - 1)]
+            weights.append(row[min(max(int(u * width), 0), width - 1)])
+        return weights
+
+    def create_instances(self, source, matrices):
+        names = ["%s_instance%d" % (source, number)
+                 for number in range(len(self.instances),
+                                     len(self.instances) + len(matrices))]
+        self.instances.extend(zip(names, matrices))
+        return names
+
+    def create_instancer(self, source, matrices):
+        name = "%s_instancer%d" % (source, len(self.instancers))
+        self.instancers.append((name, list(matrices)))
+        return name
+
+    def nodes_exist(self, nodes):
+        existing = set(name for name, _ in self.instances)
+        existing.update(name for name, _ in self.instancers)
+        return bool(nodes) and existing.issuperset(nodes)
+
+    def set_matrices(self, nodes, matrices):
+        new_matrices = dict(zip(nodes, matrices))
+        self.instances = [(name, new_matrices.get(name, matrix))
+                          for name, matrix in self.instances]
+
+    def update_instancer(self, instancer, matrices):
+        self.instancers = [(name, list(matrices) if name == instancer else old)
+                           for name, old in self.instancers]
+
+
+class CachedBackend(MeshBackend):
+    """Wrap a backend and remember its mesh queries.
+
+    The targets are assumed not to change while the cache is in use, which
+    holds for the length of a ScatterQueue run since scattering only adds
+    new nodes.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.geometry = {}
+        self.triangles = {}
+        self.hashes = {}
+        self.spheres = {}
+
+    def mesh_geometry(self, mesh):
+        if mesh not in self.geometry:
+            self.geometry[mesh] = self.backend.mesh_geometry(mesh)
+        else:
+            timing.count("scatter.geometry_hits")
+        return self.geometry[mesh]
+
+    def mesh_triangles(self, mesh):
+        if mesh not in self.triangles:
+            self.triangles[mesh] = self.backend.mesh_triangles(mesh)
+        return self.triangles[mesh]
+
+    def mesh_hash(self, mesh):
+        if mesh not in self.hashes:
+            self.hashes[mesh] = self.backend.mesh_hash(mesh)
+        return self.hashes[mesh]
+
+    def bounding_sphere(self, source):
+        if source not in self.spheres:
+            self.spheres[source] = self.backend.bounding_sphere(source)
+        return self.spheres[source]
+
+    def vertex_colour_weights(self, mesh, indices):
+        return self.backend.vertex_colour_weights(mesh, indices)
+
+    def texture_weights(self, mesh, indices, texture):
+        return self.backend.texture_weights(mesh, indices, texture)
+
+    def create_instances(self, source, matrices):
+        return self.backend.create_instances(source, matrices)
+
+    def create_instancer(self, source, matrices):
+        return self.backend.create_instancer(source, matrices)
+
+    def nodes_exist(self, nodes):
+        return self.backend.nodes_exist(nodes)
+
+    def set_matrices(self, nodes, matrices):
+        return self.backend.set_matrices(nodes, matrices)
+
+    def update_instancer(self, instancer, matrices):
+        return self.backend.update_instancer(instancer, matrices)
+
+
+class SpatialHash(object):
+    """Uniform grid of points for fixed radius neighbour queries."""
+
+    def __init__(self, cell_size):
+        self.cell_size = float(cell_size)
+        self.cells = {}
+
+    def cell(self, point):
+        """Return the grid cell containing a point."""
+        return (int(math.floor(point[0] / self.cell_size)),
+                int(math.floor(point[1] / self.cell_size)),
+                int(math.floor(point[2] / self.cell_size)))
+
+    def insert(self, point, item=None):
+        """Add a point, with an optional item stored alongside it."""
+        self.cells.setdefault(self.cell(point), []).append((point, item))
+
+    def insert_if_clear(self, point, distance):
+        """Add a point unless a stored point is closer than distance.
+
+        Returns:
+            bool: True if the point was added
+        """
+        size = self.cell_size
+        if 2.0 * distance > size:
+            if self.has_neighbour(point, distance):
+                return False
+            self.insert(point)
+            return True
+        # Same 8 cell test as has_neighbour, reusing the cell of the point
+        # for the insert and trying it first as it is the likeliest clash.
+        limit = distance * distance
+        px, py, pz = point
+        cells = self.cells
+        floor = math.floor
+        sx, sy, sz = px / size, py / size, pz / size
+        x0, y0, z0 = int(floor(sx)), int(floor(sy)), int(floor(sz))
+        home = (x0, y0, z0)
+        entries = cells.get(home)
+        if entries:
+            for other, _ in entries:
+                dx = other[0] - px
+                dy = other[1] - py
+                dz = other[2] - pz
+                if dx * dx + dy * dy + dz * dz < limit:
+                    return False
+        x1 = x0 - 1 if sx - x0 < 0.5 else x0 + 1
+        y1 = y0 - 1 if sy - y0 < 0.5 else y0 + 1
+        z1 = z0 - 1 if sz - z0 < 0.5 else z0 + 1
+        for key in ((x0, y0, z1), (x0, y1, z0), (x0, y1, z1), (x1, y0, z0),
+                    (x1, y0, z1), (x1, y1, z0), (x1, y1, z1)):
+            others = cells.get(key)
+            if not others:
+                continue
+            for other, _ in others:
+                dx = other[0] - px
+                dy = other[1] - py
+                dz = other[2] - pz
+                if dx * dx + dy * dy + dz * dz < limit:
+                    return False
+        if entries is None:
+            cells[home] = [(point, None)]
+        else:
+            entries.append((point, None))
+        return True
+
+    def nearby(self, point, radius):
+        """Yield the (point, item) pairs in every cell touched by a radius."""
+        reach = int(math.ceil(radius / self.cell_size))
+        cx, cy, cz = self.cell(point)
+        for x in range(cx - reach, cx + reach + 1):
+            for y in range(cy - reach, cy + reach + 1):
+                for z in range(cz - reach, cz + reach + 1):
+                    for entry in self.cells.get((x, y, z), ()):
+                        yield entry
+
+    def has_neighbour(self, point, distance):
+        """Return True if any stored point is closer than distance.
+
+        With cells at least twice the distance, only the two cells nearest
+        the point along every axis can hold a neighbour.
+        """
+        limit = distance * distance
+        px, py, pz = point
+        cells = self.cells
+        size = self.cell_size
+        if 2.0 * distance <= size:
+            floor = math.floor
+            sx, sy, sz = px / size, py / size, pz / size
+            x0, y0, z0 = int(floor(sx)), int(floor(sy)), int(floor(sz))
+            x1 = x0 - 1 if sx - x0 < 0.5 else x0 + 1
+            y1 = y0 - 1 if sy - y0 < 0.5 else y0 + 1
+            z1 = z0 - 1 if sz - z0 < 0.5 else z0 + 1
+            keys = ((x0, y0, z0), (x0, y0, z1), (x0, y1, z0), (x0, y1, z1),
+                    (x1, y0, z0), (x1, y0, z1), (x1, y1, z0), (x1, y1, z1))
+        else:
+            reach = int(math.ceil(distance / self.cell_size))
+            cx, cy, cz = self.cell(point)
+            keys = [(x, y, z) for x in range(cx - reach, cx + reach + 1)
+                    for y in range(cy - reach, cy + reach + 1)
+                    for z in range(cz - reach, cz + reach + 1)]
+        for key in keys:
+            entries = cells.get(key)
+            if not entries:
+                continue
+            for other, _ in entries:
+                dx = other[0] - px
+                dy = other[1] - py
+                dz = other[2] - pz
+                if dx * dx + dy * dy + dz * dz < limit:
+                    return True
+        return False
+
+
+def _chunk_transforms(task):
+    scatter_fx, positions, normals, seed, chunk_number = task
+    return scatter_fx.transforms(positions, normals,
+                                 chunk_rng(seed, chunk_number))
+
+
+def _multiply_rows(a, b):
+    return tuple(tuple(a[row][0] * b[0][col] +
+                       a[row][1] * b[1][col] +
+                       a[row][2] * b[2][col] for col in range(3))
+                 for row in range(3))
+
+
+def _cross(a, b):
+    return (a[1] * b[2] - a[2] * b[1],
+            a[2] * b[0] - a[0] * b[2],
+            a[0] * b[1] - a[1] * b[0])
+
+
+def _scaled(vector, factor):
+    return vector[0] * factor, vector[1] * factor, vector[2] * factor
+
+
+def _length(vector):
+    return math.sqrt(vector[0] ** 2 + vector[1] ** 2 + vector[2] ** 2)
+
+
+def _normalize(vector):
+    length = _length(vector)
+    return vector[0] / length, vector[1] / length, vector[2] / length
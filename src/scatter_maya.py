@@ -0,0 +1,208 @@
+"""Maya scene access for the scatter tool.
+
+Nothing here needs Qt, so scatter jobs can run headless under mayapy as
+well as from the Scatter Tool UI.
+"""
+import os
+import sys
+import math
+import multiprocessing
+import maya.cmds as cmds
+import maya.mel as mel
+import maya.api.OpenMaya as om
+
+import scatter_core
+import timing
+
+
+if sys.platform == "win32":
+    # Windows spawns worker processes with sys.executable, which is the Maya
+    # GUI itself unless pointed at mayapy.
+    multiprocessing.set_executable(os.path.join(os.path.dirname(sys.executable),
+                                                "mayapy.exe"))
+
+
+def selected_vertices():
+    """Return the selected vertex indices of every mesh in the selection.
+
+    The indices are read from the selected components directly so the
+    selection is never expanded into one name per vertex.
+
+    Returns:
+        list: (mesh path, MIntArray of vertex indices) per selected mesh
+    """
+    selection = om.MGlobal.getActiveSelectionList()
+    vertices = []
+    for item in range(selection.length()):
+        dag_path, component = selection.getComponent(item)
+        if component.isNull() or not component.hasFn(om.MFn.kMeshVertComponent):
+            continue
+        indices = om.MFnSingleIndexedComponent(component).getElements()
+        vertices.append((dag_path.fullPathName(), indices))
+    return vertices
+
+
+def get_mesh_fn(mesh):
+    """Return an MFnMesh for a mesh transform or shape path."""
+    selection = om.MSelectionList()
+    selection.add(mesh)
+    return om.MFnMesh(selection.getDagPath(0).extendToShape())
+
+
+def set_world_matrices(nodes, matrices):
+    """Apply world matrices to transforms in a single batched MEL call.
+
+    Args:
+        nodes (list): Names of the transforms to move
+        matrices (list): Flat 16 float world matrices, one per node
+    """
+    commands = []
+    for node, matrix in zip(nodes, matrices):
+        values = " ".join("%.10g" % value for value in matrix)
+        commands.append("xform -worldSpace -matrix %s %s;" % (values, node))
+    if commands:
+        mel.eval("\n".join(commands))
+        timing.count("maya.calls")
+
+
+class MayaBackend(scatter_core.MeshBackend):
+    """Scatter backend reading meshes and creating nodes in the Maya scene."""
+
+    def mesh_geometry(self, mesh):
+        mesh_fn = get_mesh_fn(mesh)
+        timing.count("maya.calls", 2)
+        return (mesh_fn.getPoints(om.MSpace.kWorld),
+                mesh_fn.getVertexNormals(False, om.MSpace.kWorld))
+
+    def mesh_hash(self, mesh):
+        """Hash the topology, placement and a spread of points of a mesh.
+
+        Sampling up to a thousand points keeps the check cheap on dense
+        meshes while still catching deformations and edits.
+        """
+        mesh_fn = get_mesh_fn(mesh)
+        bounding_box = mesh_fn.boundingBox
+        step = max(1, mesh_fn.numVertices // 1000)
+        points = tuple(tuple(mesh_fn.getPoint(index))
+                       for index in range(0, mesh_fn.numVertices, step))
+        return hash((mesh_fn.numVertices, mesh_fn.numEdges, mesh_fn.numPolygons,
+                     tuple(mesh_fn.dagPath().inclusiveMatrix()),
+                     tuple(bounding_box.min), tuple(bounding_box.max), points))
+
+    def vertex_colour_weights(self, mesh, indices):
+        colours = get_mesh_fn(mesh).getVertexColors()
+        weights = []
+        for index in indices:
+            colour = colours[index]
+            weights.append(max(0.0, (colour.r + colour.g + colour.b) / 3.0))
+        return weights
+
+    def texture_weights(self, mesh, indices, texture):
+        mesh_fn = get_mesh_fn(mesh)
+        us, vs = mesh_fn.getUVs()
+        vertex_counts, face_vertices = mesh_fn.getVertices()
+        uv_counts, uv_ids = mesh_fn.getAssignedUVs()
+        vertex_uvs = {}
+        face_vertex = 0
+        uv_offset = 0
+        for vertex_count, uv_count in zip(vertex_counts, uv_counts):
+            if uv_count:
+                for corner in range(vertex_count):
+                    vertex_uvs.setdefault(face_vertices[face_vertex + corner],
+                                          uv_ids[uv_offset + corner])
+            face_vertex += vertex_count
+            uv_offset += uv_count
+        mapped = [index for index in indices if index in vertex_uvs]
+        colours = []
+        if mapped:
+            timing.count("maya.calls")
+            colours = cmds.colorAtPoint(texture, output="RGB",
+                                        u=[us[vertex_uvs[index]] for index in mapped],
+                                        v=[vs[vertex_uvs[index]] for index in mapped])
+        brightness = {}
+        for number, index in enumerate(mapped):
+            brightness[index] = sum(colours[number * 3:number * 3 + 3]) / 3.0
+        return [brightness.get(index, 0.0) for index in indices]
+
+    def mesh_triangles(self, mesh):
+        _, triangle_vertices = get_mesh_fn(mesh).getTriangles()
+        timing.count("maya.calls")
+        return list(triangle_vertices)
+
+    def bounding_sphere(self, source):
+        bounds = cmds.xform(source, query=True, boundingBox=True, objectSpace=True)
+        timing.count("maya.calls")
+        center = tuple((bounds[axis] + bounds[axis + 3]) / 2.0 for axis in range(3))
+        radius = 0.5 * math.sqrt(sum((bounds[axis + 3] - bounds[axis]) ** 2
+                                     for axis in range(3)))
+        return center, radius
+
+    def create_instances(self, source, matrices):
+        instances = [cmds.instance(source)[0] for _ in matrices]
+        timing.count("maya.calls", len(instances))
+        set_world_matrices(instances, matrices)
+        return instances
+
+    def create_instancer(self, source, matrices):
+        """Create one particle instancer holding every scattered point.
+
+        Positions, rotations and scales are stored as per particle arrays on
+        a single particle shape instead of one transform per point.
+        """
+        positions, rotations, scales = scatter_core.decompose_matrices(matrices)
+        particle_shape = cmds.particle(position=positions, name="scatterPoints#")[1]
+        cmds.setAttr(particle_shape + ".isDynamic", False)
+        per_particle = (("rotationPP", rotations),
+                        ("scalePP", [(scale, scale, scale) for scale in scales]))
+        for attribute, values in per_particle:
+            cmds.addAttr(particle_shape, longName=attribute, dataType="vectorArray")
+            cmds.addAttr(particle_shape, longName=attribute + "0",
+                         dataType="vectorArray")
+            cmds.setAttr(particle_shape + "." + attribute + "0", len(values),
+                         *values, type="vectorArray")
+        timing.count("maya.calls", 2 + 3 * len(per_particle) + 1)
+        return cmds.particleInstancer(particle_shape, addObject=True,
+                                      object=source,
+                                      position="worldPosition",
+                                      rotation="rotationPP", scale="scalePP")
+
+    def nodes_exist(self, nodes):
+        timing.count("maya.calls")
+        return bool(nodes) and len(cmds.ls(nodes)) == len(nodes)
+
+    def set_matrices(self, nodes, matrices):
+        set_world_matrices(nodes, matrices)
+
+    def update_instancer(self, instancer, matrices):
+        particle_shape = cmds.listConnections(instancer + ".inputPoints",
+                                              shapes=True)[0]
+        positions, rotations, scales = scatter_core.decompose_matrices(matrices)
+        per_particle = (("position0", positions),
+                        ("rotationPP0", rotations),
+                        ("scalePP0", [(scale, scale, scale) for scale in scales]))
+        for attribute, values in per_particle:
+            cmds.setAttr(particle_shape + "." + attribute, len(values), *values,
+                         type="vectorArray")
+        timing.count("maya.calls", 1 + len(per_particle))
+
+
+def bake_instancer(instancer):
+    """Replace a scatter instancer with one instance transform per point.
+
+    Args:
+        instancer (str): Instancer created by create_instancer()
+
+    Returns:
+        list: The names of the new instances
+    """
+    particle_shape = cmds.listConnections(instancer + ".inputPoints",
+                                          shapes=True)[0]
+    object_to_instance = cmds.listConnections(instancer + ".inputHierarchy")[0]
+    positions = cmds.getAttr(particle_shape + ".position0")
+    rotations = cmds.getAttr(particle_shape + ".rotationPP0")
+    scales = [scale[0] for scale in cmds.getAttr(particle_shape + ".scalePP0")]
+    matrices = scatter_core.build_matrices(positions, rotations, scales)
+    instances = [cmds.instance(object_to_instance)[0] for _ in matrices]
+    set_world_matrices(instances, matrices)
+    cmds.delete(instancer, cmds.listRelatives(particle_shape, parent=True))
+    return instances
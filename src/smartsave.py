@@ -1,13 +1,19 @@
+import os
+import time
 import logging
 from PySide2 import QtWidgets, QtCore
+import shiboken2
 from shiboken2 import wrapInstance
 import maya.OpenMayaUI as omui
-import maya.cmds as cmds
-import pymel.core as pmc
-from pymel.core.system import Path
+
+import smartsave_core
+import timing
+from smartsave_scene import SceneFile, SCENE_FORMATS
 
 log = logging.getLogger(__name__)
 
+HISTORY_PAGE_SIZE = 200
+
 
 def maya_main_window():
     """Return the Maya main window widget"""
@@ -15,59 +21,244 @@ def maya_main_window():
     return wrapInstance(long(main_window), QtWidgets.QWidget)
 
 
+class CopySignals(QtCore.QObject):
+    """Signals relaying background copy callbacks to the UI thread"""
+    progress = QtCore.Signal(object, object)
+    finished = QtCore.Signal(object)
+    failed = QtCore.Signal(object)
+
+
+class HistoryModel(QtCore.QAbstractTableModel):
+    """Versions of a folder's history, fetched a page at a time"""
+    HEADERS = ["Version", "Saved", "Author", "Size", "Nodes", "Faces"]
+
+    def __init__(self, parent=None):
+        super(HistoryModel, self).__init__(parent)
+        self.history = None
+        self.versions = []
+        self.total = 0
+
+    def set_folder(self, folder_path):
+        """Show the history of folder_path, loading its first page only"""
+        self.beginResetModel()
+        self.history = smartsave_core.HistoryIndex(folder_path)
+        self.versions = []
+        self.total = self.history.count() if self.history.exists() else 0
+        self.endResetModel()
+
+    def version(self, row):
+        return self.versions[row]
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.versions)
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.HEADERS)
+
+    def canFetchMore(self, parent):
+        return not parent.isValid() and len(self.versions) < self.total
+
+    def fetchMore(self, parent):
+        page = self.history.page(len(self.versions), HISTORY_PAGE_SIZE)
+        if not page:
+            self.total = len(self.versions)
+            return
+        self.beginInsertRows(QtCore.QModelIndex(), len(self.versions),
+                             len(self.versions) + len(page) - 1)
+        self.versions.extend(page)
+        self.endInsertRows()
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if orientation == QtCore.Qt.Horizontal and role == QtCore.Qt.DisplayRole:
+            return self.HEADERS[section]
+        return None
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if role != QtCore.Qt.DisplayRole or not index.isValid():
+            return None
+        version = self.versions[index.row()]
+        column = index.column()
+        if column == 0:
+            return version["filename"]
+        if column == 1:
+            return time.strftime("%Y-%m-%d %H:%M", time.localtime(version["saved"]))
+        if column == 2:
+            return version["author"]
+        if column == 3:
+            return "%.1f MB" % (version["size"] / 1048576.0)
+        stat = "nodes" if column == 4 else "faces"
+        return str(version["stats"].get(stat, ""))
+
+
 class SmartSaveUI(QtWidgets.QDialog):
     """Smart Class UI Class"""
+    _instance = None
+
+    @classmethod
+    def show_dialog(cls):
+        """Show the dialog, reusing the one built by an earlier launch"""
+        if cls._instance is None or not shiboken2.isValid(cls._instance):
+            cls._instance = cls()
+        else:
+            cls._instance.load_scenefile(SceneFile())
+        cls._instance.show()
+        cls._instance.raise_()
+        cls._instance.activateWindow()
+        return cls._instance
 
     def __init__(self):
         super(SmartSaveUI, self).__init__(parent=maya_main_window())
         self.setWindowTitle("Smart Save")
         self.setMinimumWidth(500)
-        self.setMaximumHeight(200)
+        self.setMaximumHeight(560)
         self.setWindowFlags(self.windowFlags() ^
                             QtCore.Qt.WindowContextHelpButtonHint)
         self.scenefile = SceneFile()
+        self.copy_signals = CopySignals()
         self.create_ui()
         self.create_connections()
 
+    def load_scenefile(self, scenefile):
+        """Show the properties of scenefile in the UI"""
+        scenefile.background_copy = self.scenefile.background_copy
+        self.scenefile = scenefile
+        self.folder_le.setText(scenefile.folder_path)
+        self.descriptor_le.setText(scenefile.descriptor)
+        self.task_le.setText(scenefile.task)
+        self.ver_sbx.setValue(scenefile.ver)
+        self.ext_cmb.setCurrentText(scenefile.ext)
+        for token, token_le in self.token_les.items():
+            token_le.setText(scenefile.tokens.get(token, ""))
+        self._refresh_history()
+
     def create_ui(self):
         self.title_lbl = QtWidgets.QLabel("Smart Save")
         self.title_lbl.setStyleSheet("font: bold 20px")
         self.folder_lay = self._create_folder_ui()
         self.filename_lay = self._create_filename_ui()
+        self.tokens_lay = self._create_tokens_ui()
         self.button_lay = self._create_button_ui()
+        self.progress_lay = self._create_progress_ui()
+        self.history_lay = self._create_history_ui()
         self.main_lay = QtWidgets.QVBoxLayout()
         self.main_lay.addWidget(self.title_lbl)
         self.main_lay.addLayout(self.folder_lay)
         self.main_lay.addLayout(self.filename_lay)
+        self.main_lay.addLayout(self.tokens_lay)
         self.main_lay.addStretch()
         self.main_lay.addLayout(self.button_lay)
+        self.main_lay.addLayout(self.progress_lay)
+        self.main_lay.addLayout(self.history_lay)
         self.setLayout(self.main_lay)
+        self._refresh_history()
 
     def create_connections(self):
         """Connects Signals and Slots"""
         self.folder_browse_btn.clicked.connect(self._browse_folder)
         self.save_btn.clicked.connect(self._save)
         self.save_inc_btn.clicked.connect(self._save_increment)
+        self.open_btn.clicked.connect(self._open)
+        self.copy_signals.progress.connect(self._copy_progress)
+        self.copy_signals.finished.connect(self._copy_finished)
+        self.copy_signals.failed.connect(self._copy_failed)
+        self.folder_le.editingFinished.connect(self._refresh_history)
+        self.history_view.doubleClicked.connect(self._open_history_version)
+        self.rescan_btn.clicked.connect(self._rescan_history)
 
     @QtCore.Slot()
     def _save_increment(self):
         """Save an increment of the scene"""
         self._set_scenefile_properties_from_ui()
-        self.scenefile.save_increment()
+        try:
+            self.scenefile.save_increment(**self._save_options())
+        except (RuntimeError, ValueError) as err:
+            QtWidgets.QMessageBox.warning(self, "Smart Save", str(err))
+            return
         self.ver_sbx.setValue(self.scenefile.ver)
+        self._refresh_history()
+        timing.log_report(log)
 
     @QtCore.Slot()
     def _save(self):
         """Save the scene"""
         self._set_scenefile_properties_from_ui()
-        self.scenefile.save()
+        try:
+            self.scenefile.save(**self._save_options())
+        except (RuntimeError, ValueError) as err:
+            QtWidgets.QMessageBox.warning(self, "Smart Save", str(err))
+            return
+        self._refresh_history()
+        timing.log_report(log)
+
+    @QtCore.Slot()
+    def _open(self):
+        """Open the version of the scene, restoring it from the store"""
+        self._set_scenefile_properties_from_ui()
+        self._open_scenefile()
+
+    def _open_scenefile(self):
+        try:
+            self.scenefile.open()
+        except IOError as err:
+            QtWidgets.QMessageBox.warning(self, "Smart Save", str(err))
+
+    @QtCore.Slot()
+    def _refresh_history(self):
+        """Show the history of the folder without listing the folder"""
+        self.history_model.set_folder(self.folder_le.text())
+        self.history_lbl.setText("%d versions" % self.history_model.total)
+
+    @QtCore.Slot()
+    def _rescan_history(self):
+        """Add scenes missing from the history by listing the folder"""
+        history = smartsave_core.HistoryIndex(self.folder_le.text())
+        added = history.rebuild()
+        self._refresh_history()
+        self.status_lbl.setText("Added %d versions to the history" % added)
+
+    def _open_history_version(self, index):
+        """Open the version double clicked in the history"""
+        version = self.history_model.version(index.row())
+        scenefile = SceneFile(os.path.join(self.folder_le.text(),
+                                           version["filename"]))
+        scenefile.dedupe = self.dedupe_cbx.isChecked()
+        self.load_scenefile(scenefile)
+        self._open_scenefile()
+
+    def _save_options(self):
+        background = self.background_cbx.isChecked()
+        if background:
+            self.progress_bar.setValue(0)
+            self.status_lbl.setText("Copying to %s..." % self.scenefile.folder_path)
+        return dict(background=background,
+                    progress=self.copy_signals.progress.emit,
+                    finished=self.copy_signals.finished.emit,
+                    failed=self.copy_signals.failed.emit)
+
+    def _copy_progress(self, copied, total):
+        self.progress_bar.setValue(int(100 * copied / max(total, 1)))
+
+    def _copy_finished(self, path):
+        self.progress_bar.setValue(100)
+        self.status_lbl.setText("Saved %s" % os.path.basename(path))
+        self._refresh_history()
+        timing.log_report(log)
+
+    def _copy_failed(self, error):
+        self.status_lbl.setText("Save failed")
+        QtWidgets.QMessageBox.warning(self, "Smart Save",
+                                      "The scene could not be copied to the "
+                                      "scenes folder:\n%s" % error)
 
     def _set_scenefile_properties_from_ui(self):
         self.scenefile.folder_path = self.folder_le.text()
         self.scenefile.descriptor = self.descriptor_le.text()
         self.scenefile.task = self.task_le.text()
         self.scenefile.ver = self.ver_sbx.value()
-        self.scenefile.ext = self.ext_lbl.text()
+        self.scenefile.ext = self.ext_cmb.currentText()
+        self.scenefile.dedupe = self.dedupe_cbx.isChecked()
+        self.scenefile.tokens = dict((token, token_le.text())
+                                     for token, token_le in self.token_les.items())
 
     @QtCore.Slot()
     def _browse_folder(self):
@@ -79,13 +270,50 @@ class SmartSaveUI(QtWidgets.QDialog):
         self.folder_le.setText(folder)
 
     def _create_button_ui(self):
+        self.background_cbx = QtWidgets.QCheckBox("Save in Background")
+        self.background_cbx.setChecked(True)
+        self.dedupe_cbx = QtWidgets.QCheckBox("Deduplicate Versions")
+        self.dedupe_cbx.setToolTip("Keep older versions as shared chunks in "
+                                   "the folder's .versions store")
+        self.open_btn = QtWidgets.QPushButton("Open")
         self.save_btn = QtWidgets.QPushButton("Save")
         self.save_inc_btn = QtWidgets.QPushButton("Save Increment")
         layout = QtWidgets.QHBoxLayout()
+        layout.addWidget(self.background_cbx)
+        layout.addWidget(self.dedupe_cbx)
+        layout.addWidget(self.open_btn)
         layout.addWidget(self.save_btn)
         layout.addWidget(self.save_inc_btn)
         return layout
 
+    def _create_progress_ui(self):
+        self.progress_bar = QtWidgets.QProgressBar()
+        self.progress_bar.setRange(0, 100)
+        self.status_lbl = QtWidgets.QLabel()
+        layout = QtWidgets.QHBoxLayout()
+        layout.addWidget(self.progress_bar)
+        layout.addWidget(self.status_lbl)
+        return layout
+
+    def _create_history_ui(self):
+        self.history_model = HistoryModel(self)
+        self.history_view = QtWidgets.QTableView()
+        self.history_view.setModel(self.history_model)
+        self.history_view.setSelectionBehavior(QtWidgets.QAbstractItemView.SelectRows)
+        self.history_view.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
+        self.history_view.verticalHeader().hide()
+        self.history_view.horizontalHeader().setStretchLastSection(True)
+        self.history_lbl = QtWidgets.QLabel()
+        self.rescan_btn = QtWidgets.QPushButton("Rescan Folder")
+        header_lay = QtWidgets.QHBoxLayout()
+        header_lay.addWidget(self.history_lbl)
+        header_lay.addStretch()
+        header_lay.addWidget(self.rescan_btn)
+        layout = QtWidgets.QVBoxLayout()
+        layout.addLayout(header_lay)
+        layout.addWidget(self.history_view)
+        return layout
+
     def _create_filename_ui(self):
         layout = self._create_filename_headers()
         self.descriptor_le = QtWidgets.QLineEdit(self.scenefile.descriptor)
@@ -94,15 +322,34 @@ class SmartSaveUI(QtWidgets.QDialog):
         self.task_le.setFixedWidth(50)
         self.ver_sbx = QtWidgets.QSpinBox()
         self.ver_sbx.setButtonSymbols(QtWidgets.QAbstractSpinBox.PlusMinus)
-        self.ver_sbx.setFixedWidth(50)
+        self.ver_sbx.setRange(1, 999999)
+        self.ver_sbx.setFixedWidth(70)
         self.ver_sbx.setValue(self.scenefile.ver)
-        self.ext_lbl = QtWidgets.QLabel(".ma")
+        self.ext_cmb = QtWidgets.QComboBox()
+        self.ext_cmb.addItems(SCENE_FORMATS)
+        self.ext_cmb.setCurrentText(self.scenefile.ext)
         layout.addWidget(self.descriptor_le, 1, 0)
         layout.addWidget(QtWidgets.QLabel("_"), 1, 1)
         layout.addWidget(self.task_le, 1, 2)
         layout.addWidget(QtWidgets.QLabel("_v"), 1, 3)
         layout.addWidget(self.ver_sbx, 1, 4)
-        layout.addWidget(self.ext_lbl, 1, 5)
+        layout.addWidget(self.ext_cmb, 1, 5)
+        return layout
+
+    def _create_tokens_ui(self):
+        """Create a field for every naming schema token not in the row above"""
+        self.token_les = {}
+        layout = QtWidgets.QHBoxLayout()
+        for token in smartsave_core.SCHEMA.tokens:
+            if token not in self.scenefile.tokens:
+                continue
+            token_lbl = QtWidgets.QLabel(token.capitalize())
+            token_lbl.setStyleSheet("font: bold")
+            token_le = QtWidgets.QLineEdit(self.scenefile.tokens[token])
+            token_le.setToolTip("Naming schema: %s" % smartsave_core.SCHEMA.template)
+            self.token_les[token] = token_le
+            layout.addWidget(token_lbl)
+            layout.addWidget(token_le)
         return layout
 
     def _create_filename_headers(self):
@@ -119,96 +366,9 @@ class SmartSaveUI(QtWidgets.QDialog):
         return layout
 
     def _create_folder_ui(self):
-        default_folder = Path(cmds.workspace(rootDirectory=True, query=True))
-        default_folder = default_folder / "scenes"
-        self.folder_le = QtWidgets.QLineEdit(default_folder)
+        self.folder_le = QtWidgets.QLineEdit(self.scenefile.folder_path)
         self.folder_browse_btn = QtWidgets.QPushButton("...")
         layout = QtWidgets.QHBoxLayout()
         layout.addWidget(self.folder_le)
         layout.addWidget(self.folder_browse_btn)
         return layout
-
-
-class SceneFile(object):
-    """"An abstract representation of a Scene file."""
-    def __init__(self, path=None):
-        self._folder_path = Path(cmds.workspace(query=True, rootDirectory=True)) / "scenes"
-        self.descriptor = 'main'
-        self.task = 'model'
-        self.ver = 1
-        self.ext = '.ma'
-        scene = pmc.system.sceneName()
-        if not path and scene:
-            path = scene
-        if not path and not scene:
-            log.info("Initialize with default properties.")
-            return
-        self._init_from_path(path)
-
-    @property
-    def folder_path(self):
-        return self._folder_path
-
-    @folder_path.setter
-    def folder_path(self, val):
-        self._folder_path = Path(val)
-
-    @property
-    def filename(self):
-        pattern = "{descriptor}_{task}_v{ver:03d}{ext}"
-        return pattern.format(descriptor=self.descriptor,
-                              task=self.task,
-                              ver=self.ver,
-                              ext=self.ext)
-
-    @property
-    def path(self):
-        return self.folder_path / self.filename
-
-    def _init_from_path(self, path):
-        path = Path(path)
-        self.folder_path = path.parent
-        self.ext = path.ext
-        self.descriptor, self.task, ver = path.name.stripext().split("_")
-        self.ver = int(ver.split("v")[-1])
-
-    def save(self):
-        """Saves the scene file.
-
-        Returns:
-            Path: The path to the scene file if successful
-        """
-        try:
-            return pmc.system.saveAs(self.path)
-        except RuntimeError as err:
-            log.warning("Missing directories in path. Creating folder...")
-            self.folder_path.makedirs_p()
-            return pmc.system.saveAs(self.path)
-
-    def next_avail_ver(self):
-        """Return the next available version number in the folder."""
-        pattern = "{descriptor}_{task}_v*{ext}".format(
-            descriptor=self.descriptor, task=self.task, ext=self.ext)
-        matching_scenefiles = []
-        for file_ in self.folder_path.files():
-            if file_.name.fnmatch(pattern):
-                matching_scenefiles.append(file_)
-        if not matching_scenefiles:
-            return 1
-        matching_scenefiles.sort(reverse=True)
-        latest_scenefile = matching_scenefiles[0]
-        latest_scenefile = latest_scenefile.name.stripext()
-        latest_ver_num = int(latest_scenefile.split("_v")[-1])
-        return latest_ver_num + 1
-
-    def save_increment(self):
-        """Increments the version and saves the scene file.
-
-        If the existing version of a file already exists, it should increment from the largest
-        version number available in the folder.
-
-        Returns:
-            Path: The path to the scene file if successful
-        """
-        self.ver = self.next_avail_ver()
-        self.save()
@@ -0,0 +1,384 @@
+"""Re-version, rename and relocate scene files in bulk without Maya.
+
+Scenes are found and renamed through the Smart Save naming schema. The
+operations are planned first, written to a journal, then run on a pool of
+threads, so an interrupted batch can be resumed from its journal::
+
+    python smartsave_batch.py scenes --set task=anim --reversion --dry-run
+    python smartsave_batch.py scenes --dest new_scenes --layout {descriptor}/{task}
+    python smartsave_batch.py --resume batch.journal
+
+Moving and copying only touch files. Versions only kept in a folder's
+version store are restored to normal files at their destination, and the
+version history follows the scenes. Changing the extension converts the
+scene between .ma and .mb, which opens it and needs mayapy.
+"""
+import os
+import json
+import errno
+import shutil
+import logging
+import argparse
+import threading
+from multiprocessing.pool import ThreadPool
+
+import smartsave_core
+
+log = logging.getLogger(__name__)
+
+_maya_initialized = False
+
+
+class BatchOperation(object):
+    """A move, copy, restore or conversion of one scene file"""
+    __slots__ = ("source", "destination", "action")
+
+    def __init__(self, source, destination, action):
+        self.source = source
+        self.destination = destination
+        self.action = action
+
+    def to_dict(self):
+        return {"source": self.source, "destination": self.destination,
+                "action": self.action}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["source"], data["destination"], data["action"])
+
+
+def parse_tokens(values):
+    """Return a dict from "token=value" strings."""
+    tokens = {}
+    for value in values or []:
+        token, sep, text = value.partition("=")
+        if not sep:
+            raise ValueError("Expected token=value, got %s" % value)
+        tokens[token] = int(text) if token == "ver" else text
+    return tokens
+
+
+def find_scenes(root, where=None):
+    """Yield the folder, file name and tokens of every scene under root.
+
+    Versions only kept in a folder's version store are included. Hidden
+    folders, such as the version store itself, are not searched.
+
+    Args:
+        root (str): Folder to search
+        where (dict): Only yield scenes with these token values
+    """
+    for folder_path, folders, filenames in os.walk(root):
+        folders[:] = sorted(folder for folder in folders if not folder.startswith("."))
+        stored = smartsave_core.VersionStore.for_folder(folder_path).filenames()
+        for filename in sorted(set(filenames).union(stored)):
+            fields = smartsave_core.SCHEMA.parse(filename)
+            if fields is None:
+                continue
+            if where and any(fields.get(token) != value
+                             for token, value in where.items()):
+                continue
+            yield folder_path, filename, fields
+
+
+def plan_operations(root, dest=None, layout=None, changes=None, where=None,
+                    reversion=False, copy=False):
+    """Plan the operations of a batch.
+
+    Args:
+        root (str): Folder to find scenes in
+        dest (str): Folder to move the scenes to, root by default
+        layout (str): Folder template below dest, e.g. "{descriptor}/{task}".
+            By default every scene keeps its folder relative to root.
+        changes (dict): Token values to set, e.g. {"task": "anim"}
+        where (dict): Only plan scenes with these token values
+        reversion (bool): Number the versions of every renamed scene
+            consecutively after the latest version at its destination
+        copy (bool): Copy the scenes instead of moving them
+
+    Returns:
+        tuple: The list of operations and a list of (source, reason) of the
+            scenes that were skipped
+
+    Raises:
+        ValueError: If the layout uses a token the naming schema lacks
+    """
+    dest = dest or root
+    changes = changes or {}
+    groups = {}
+    for folder_path, filename, fields in find_scenes(root, where):
+        new_fields = dict(fields, **changes)
+        if layout:
+            try:
+                dest_folder = os.path.join(dest, layout.format(**new_fields))
+            except KeyError as err:
+                raise ValueError("Layout %s uses %s, which is not a token of the "
+                                 "naming schema %s" % (layout, err,
+                                                       smartsave_core.SCHEMA.template))
+            except IndexError:
+                raise ValueError("Layout %s can only use named tokens" % layout)
+        else:
+            dest_folder = os.path.join(dest, os.path.relpath(folder_path, root))
+        dest_folder = os.path.normpath(dest_folder)
+        key = (dest_folder, smartsave_core.SCHEMA.key(new_fields))
+        groups.setdefault(key, []).append(
+            (os.path.join(folder_path, filename), fields, new_fields))
+
+    operations = []
+    skipped = []
+    targets = set()
+    for (dest_folder, key), scenes in sorted(groups.items()):
+        scenes.sort(key=lambda scene: scene[1]["ver"])
+        ver = 0
+        if reversion:
+            name_fields = dict(scenes[0][2])
+            del name_fields["ver"]
+            ver = smartsave_core.VersionIndex.for_folder(dest_folder).latest(**name_fields)
+        for source, fields, new_fields in scenes:
+            if reversion:
+                ver += 1
+                new_fields["ver"] = ver
+            destination = os.path.join(dest_folder,
+                                       smartsave_core.SCHEMA.format(**new_fields))
+            if os.path.normcase(destination) == os.path.normcase(source):
+                continue
+            if destination in targets or os.path.exists(destination):
+                skipped.append((source, "%s already exists" % destination))
+                continue
+            converting = new_fields.get("ext") != fields.get("ext")
+            if not os.path.exists(source):
+                if converting:
+                    skipped.append((source, "only in the version store, open it "
+                                            "once to restore it before converting"))
+                    continue
+                action = "restore" if copy else "restore_move"
+            elif converting:
+                action = "convert" if copy else "convert_move"
+            else:
+                action = "copy" if copy else "move"
+            targets.add(destination)
+            operations.append(BatchOperation(source, destination, action))
+    return operations, skipped
+
+
+def write_journal(path, operations):
+    """Start a journal with the planned operations."""
+    with open(path, "w") as journal:
+        journal.write(json.dumps({"plan": [operation.to_dict()
+                                           for operation in operations]}) + "\n")
+
+
+def read_journal(path):
+    """Return the planned operations of a journal and the indices done."""
+    done = set()
+    with open(path) as journal:
+        operations = [BatchOperation.from_dict(data)
+                      for data in json.loads(journal.readline())["plan"]]
+        for line in journal:
+            try:
+                done.add(json.loads(line)["done"])
+            except (ValueError, KeyError):
+                # A line cut short by an interruption is retried.
+                continue
+    return operations, done
+
+
+def is_done(operation):
+    """Return True if an operation finished before its journal entry was written."""
+    if not os.path.exists(operation.destination):
+        return False
+    if operation.action in ("move", "convert_move"):
+        return not os.path.exists(operation.source)
+    if operation.action.startswith("restore"):
+        # Restores are written atomically, so an existing file is complete.
+        return True
+    return (operation.action == "convert" or
+            os.path.getsize(operation.source) == os.path.getsize(operation.destination))
+
+
+def restore_file(operation):
+    """Rebuild a version only kept in the version store at its destination."""
+    if os.path.exists(operation.destination):
+        raise IOError(errno.EEXIST, "%s already exists" % operation.destination)
+    smartsave_core.make_folder(os.path.dirname(operation.destination))
+    source_folder, filename = os.path.split(operation.source)
+    smartsave_core.VersionStore.for_folder(source_folder).restore(
+        filename, operation.destination)
+
+
+def move_history(operation):
+    """Carry the history of a scene over to its destination folder.
+
+    A scene moved out of a folder is also dropped from that folder's
+    version store, so neither lists it any more.
+    """
+    source_folder, filename = os.path.split(operation.source)
+    moved = operation.action in ("move", "convert_move", "restore_move")
+    if moved:
+        smartsave_core.VersionStore.for_folder(source_folder).remove(filename)
+    history = smartsave_core.HistoryIndex(source_folder)
+    if not history.exists():
+        return
+    version = history.version(filename)
+    if version is None:
+        return
+    smartsave_core.HistoryIndex(os.path.dirname(operation.destination)).record(
+        operation.destination, version["stats"], version["author"], version["saved"])
+    if moved:
+        history.remove(filename)
+
+
+def transfer_file(operation):
+    """Copy or move a scene without overwriting an existing file."""
+    if os.path.exists(operation.destination):
+        raise IOError(errno.EEXIST, "%s already exists" % operation.destination)
+    smartsave_core.make_folder(os.path.dirname(operation.destination))
+    if operation.action == "move":
+        try:
+            os.rename(operation.source, operation.destination)
+            return
+        except OSError as err:
+            if err.errno != errno.EXDEV:
+                raise
+    smartsave_core.atomic_write(operation.destination,
+                                lambda temporary: shutil.copy2(operation.source,
+                                                               temporary))
+    if operation.action == "move":
+        os.remove(operation.source)
+
+
+def convert_scene(operation):
+    """Open a scene in mayapy and save it in the format of its destination."""
+    global _maya_initialized
+    import maya.standalone
+    import maya.cmds as cmds
+    if not _maya_initialized:
+        maya.standalone.initialize(name="python")
+        _maya_initialized = True
+    smartsave_core.make_folder(os.path.dirname(operation.destination))
+    scene_type = smartsave_core.SCENE_TYPES[
+        os.path.splitext(operation.destination)[1]]
+    cmds.file(operation.source, open=True, force=True, prompt=False)
+
+    def save(temporary):
+        cmds.file(rename=temporary)
+        cmds.file(save=True, type=scene_type, force=True)
+    smartsave_core.atomic_write(operation.destination, save)
+    if operation.action == "convert_move":
+        os.remove(operation.source)
+
+
+def run_operations(operations, journal_path, done=None, workers=8):
+    """Run the operations not done yet and record each one in the journal.
+
+    File moves and copies run on a pool of threads. Conversions open the
+    scene in Maya and run one after the other once the files are done.
+
+    Returns:
+        list: (source, error) of every operation that failed
+    """
+    done = done or set()
+    lock = threading.Lock()
+    failures = []
+
+    def run(index):
+        operation = operations[index]
+        try:
+            if is_done(operation):
+                pass
+            elif operation.action.startswith("convert"):
+                convert_scene(operation)
+            elif operation.action.startswith("restore"):
+                restore_file(operation)
+            else:
+                transfer_file(operation)
+            move_history(operation)
+        except Exception as err:
+            log.error("%s %s failed: %s", operation.action, operation.source, err)
+            return operation.source, err
+        with lock:
+            with open(journal_path, "a") as journal:
+                journal.write(json.dumps({"done": index}) + "\n")
+        log.info("%-8s %s -> %s", operation.action, operation.source,
+                 operation.destination)
+        return None
+
+    pending = [index for index in range(len(operations)) if index not in done]
+    transfers = [index for index in pending
+                 if not operations[index].action.startswith("convert")]
+    conversions = [index for index in pending if index not in transfers]
+    if transfers:
+        pool = ThreadPool(max(1, workers))
+        try:
+            failures.extend(result for result in pool.imap_unordered(run, transfers)
+                            if result)
+        finally:
+            pool.close()
+            pool.join()
+    failures.extend(result for result in map(run, conversions) if result)
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("root", nargs="?", help="folder to find scenes in")
+    parser.add_argument("--dest", help="folder to move the scenes to")
+    parser.add_argument("--layout", help="folder template below --dest, "
+                                         "e.g. {descriptor}/{task}")
+    parser.add_argument("--set", nargs="*", default=[], metavar="TOKEN=VALUE",
+                        help="token values to rename the scenes with")
+    parser.add_argument("--where", nargs="*", default=[], metavar="TOKEN=VALUE",
+                        help="only touch scenes with these token values")
+    parser.add_argument("--reversion", action="store_true",
+                        help="number versions after the latest at the destination")
+    parser.add_argument("--copy", action="store_true",
+                        help="copy the scenes instead of moving them")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--dry-run", action="store_true",
+                        help="only print the planned operations")
+    parser.add_argument("--journal", default="smartsave_batch.journal",
+                        help="journal to record the batch in")
+    parser.add_argument("--resume", metavar="JOURNAL",
+                        help="finish the batch recorded in a journal")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    if args.resume:
+        journal_path = args.resume
+        operations, done = read_journal(journal_path)
+        log.info("Resuming %d of %d operations", len(operations) - len(done),
+                 len(operations))
+    else:
+        if not args.root:
+            parser.error("a root folder or --resume is required")
+        try:
+            changes = parse_tokens(args.set)
+            where = parse_tokens(args.where)
+        except ValueError as err:
+            parser.error(str(err))
+        try:
+            operations, skipped = plan_operations(
+                args.root, args.dest, args.layout, changes, where, args.reversion,
+                args.copy)
+        except ValueError as err:
+            parser.error(str(err))
+        for source, reason in skipped:
+            log.warning("skip     %s: %s", source, reason)
+        if args.dry_run:
+            for operation in operations:
+                log.info("%-8s %s -> %s", operation.action, operation.source,
+                         operation.destination)
+            log.info("%d operations, %d skipped", len(operations), len(skipped))
+            return
+        journal_path = args.journal
+        write_journal(journal_path, operations)
+        done = set()
+    failures = run_operations(operations, journal_path, done, args.workers)
+    if failures:
+        log.error("%d operations failed, run again with --resume %s",
+                  len(failures), journal_path)
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,750 @@
+"""Maya independent file handling for Smart Save.
+
+Version lookup, version reservation, atomic file replacement, background
+copies, the deduplicated version store and the version history only use the
+standard library so they can be run and stress tested outside Maya.
+"""
+import os
+import re
+import sys
+import io
+import json
+import time
+import zlib
+import errno
+import hashlib
+import random
+import ctypes
+import sqlite3
+import getpass
+import logging
+import tempfile
+import threading
+
+import timing
+
+log = logging.getLogger(__name__)
+
+FILENAME_PATTERN = os.environ.get("SMARTSAVE_NAMING",
+                                  "{descriptor}_{task}_v{ver:03d}{ext}")
+RETRY_ERRNOS = (errno.EACCES, errno.EAGAIN, errno.EBUSY)
+SCRATCH_FOLDER = os.environ.get("SMARTSAVE_SCRATCH",
+                                os.path.join(tempfile.gettempdir(), "smartsave"))
+SCENE_TYPES = {".ma": "mayaAscii", ".mb": "mayaBinary"}
+MOVEFILE_REPLACE_EXISTING = 0x1
+MOVEFILE_WRITE_THROUGH = 0x8
+
+
+class NamingSchema(object):
+    """Scene file naming template compiled into a regex and a formatter.
+
+    Tokens are written as format fields, e.g.
+    "{shot}_{descriptor}_{task}_v{ver:03d}_{user}{ext}". "ver" only matches
+    digits and is parsed to an int, "ext" matches a file extension and any
+    other token matches a run of characters without an underscore.
+    """
+    __slots__ = ("template", "tokens", "key_tokens", "regex")
+    TOKEN = re.compile(r"\{(\w+)(?::[^}]*)?\}")
+    TOKEN_PATTERNS = {"ver": r"\d+", "ext": r"\.[^._]+"}
+    DEFAULT_TOKEN_PATTERN = r"[^_/\\]+"
+
+    def __init__(self, template):
+        self.template = template
+        self.tokens = []
+        pattern = []
+        position = 0
+        for match in self.TOKEN.finditer(template):
+            token = match.group(1)
+            if token in self.tokens:
+                raise ValueError("Token %s repeats in naming schema %s"
+                                 % (token, template))
+            self.tokens.append(token)
+            pattern.append(re.escape(template[position:match.start()]))
+            pattern.append("(?P<%s>%s)" % (token, self.TOKEN_PATTERNS.get(
+                token, self.DEFAULT_TOKEN_PATTERN)))
+            position = match.end()
+        pattern.append(re.escape(template[position:]))
+        if "ver" not in self.tokens:
+            raise ValueError("Naming schema %s has no {ver} token" % template)
+        self.key_tokens = tuple(token for token in self.tokens if token != "ver")
+        self.regex = re.compile("^%s$" % "".join(pattern))
+
+    def parse(self, filename):
+        """Return the tokens of a file name, or None if it does not match."""
+        match = self.regex.match(filename)
+        if match is None:
+            return None
+        fields = match.groupdict()
+        fields["ver"] = int(fields["ver"])
+        return fields
+
+    def format(self, **fields):
+        """Return the file name of the tokens in fields."""
+        return self.template.format(**fields)
+
+    def key(self, fields):
+        """Return the tokens of fields that name a scene regardless of version."""
+        return tuple(fields.get(token, "") for token in self.key_tokens)
+
+
+SCHEMA = NamingSchema(FILENAME_PATTERN)
+
+
+def make_folder(folder_path):
+    """Create folder_path and its parents unless they exist."""
+    try:
+        os.makedirs(folder_path)
+    except OSError as err:
+        if err.errno != errno.EEXIST:
+            raise
+
+
+def scene_filename(descriptor, task, ver, ext, **tokens):
+    """Return the file name of a scene version."""
+    return SCHEMA.format(descriptor=descriptor, task=task, ver=ver, ext=ext,
+                         **tokens)
+
+
+class VersionIndex(object):
+    """Latest saved version of every scene name in a folder.
+
+    The folder is listed once and listed again only when its modification
+    time changes, so repeated lookups cost a single stat call.
+    """
+    MTIME_RESOLUTION = 2.0
+    _indices = {}
+
+    def __init__(self, folder_path):
+        self.folder_path = folder_path
+        self.versions = {}
+        self.mtime = None
+
+    @classmethod
+    def for_folder(cls, folder_path):
+        """Return the shared index of a folder."""
+        key = os.path.normcase(os.path.abspath(folder_path))
+        if key not in cls._indices:
+            cls._indices[key] = cls(folder_path)
+        return cls._indices[key]
+
+    def refresh(self):
+        """Scan the folder again if it changed since the last scan."""
+        try:
+            mtime = os.stat(self.folder_path).st_mtime
+        except OSError:
+            self.versions = {}
+            self.mtime = None
+            return
+        if mtime != self.mtime:
+            self.scan(mtime)
+
+    def scan(self, mtime=None):
+        """List the folder and record the highest version of every name.
+
+        Versions only kept in the folder's version store count as saved.
+        """
+        scan_time = time.time()
+        versions = {}
+        with timing.span("save.scan_folder"):
+            names = os.listdir(self.folder_path)
+            names.extend(VersionStore.for_folder(self.folder_path).filenames())
+        timing.count("save.scanned_files", len(names))
+        for name in names:
+            fields = SCHEMA.parse(name)
+            if fields is None:
+                continue
+            key = SCHEMA.key(fields)
+            versions[key] = max(versions.get(key, 0), fields["ver"])
+        self.versions = versions
+        # A folder changed within the timestamp resolution of the scan may
+        # change again without a new mtime, so it is scanned next time too.
+        if mtime is not None and scan_time - mtime < self.MTIME_RESOLUTION:
+            mtime = None
+        self.mtime = mtime
+
+    def latest(self, descriptor, task, ext, **tokens):
+        """Return the highest saved version, or 0 if there is none."""
+        self.refresh()
+        tokens.update(descriptor=descriptor, task=task, ext=ext)
+        return self.versions.get(SCHEMA.key(tokens), 0)
+
+    def add(self, descriptor, task, ver, ext, **tokens):
+        """Record a version saved by this session.
+
+        If the index was up to date before the save, the folder's new mtime
+        is adopted so the save does not cause a scan of its own. A version
+        written by another process in between is then only seen after the
+        next change to the folder; reserve_version still skips it.
+        """
+        tokens.update(descriptor=descriptor, task=task, ext=ext)
+        key = SCHEMA.key(tokens)
+        self.versions[key] = max(self.versions.get(key, 0), ver)
+        if self.mtime is not None:
+            try:
+                self.mtime = os.stat(self.folder_path).st_mtime
+            except OSError:
+                self.mtime = None
+
+
+def reserve_version(folder_path, descriptor, task, ext, attempts=8, delay=0.05,
+                    **tokens):
+    """Claim the next free version by creating its file exclusively.
+
+    The empty file created here marks the version as taken for every other
+    process saving to the folder until the real scene replaces it. Versions
+    taken in the meantime are skipped; transient filesystem errors are
+    retried with an exponential backoff.
+
+    Args:
+        folder_path (str): Folder to save the scene to
+        descriptor (str): Descriptor of the scene name
+        task (str): Task of the scene name
+        ext (str): Extension of the scene file, e.g. ".ma"
+        attempts (int): Number of retries on transient errors
+        delay (float): Initial retry delay in seconds
+        **tokens: Other tokens of the naming schema, e.g. shot
+
+    Returns:
+        int: The reserved version number
+    """
+    index = VersionIndex.for_folder(folder_path)
+    ver = index.latest(descriptor, task, ext, **tokens) + 1
+    retries = 0
+    while True:
+        path = os.path.join(folder_path,
+                            scene_filename(descriptor, task, ver, ext, **tokens))
+        try:
+            os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        except OSError as err:
+            if err.errno == errno.EEXIST:
+                ver = max(ver + 1, index.latest(descriptor, task, ext, **tokens) + 1)
+                continue
+            if err.errno not in RETRY_ERRNOS or retries >= attempts:
+                raise
+            time.sleep(delay * 2 ** retries * random.uniform(0.5, 1.5))
+            retries += 1
+            continue
+        index.add(descriptor, task, ver, ext, **tokens)
+        return ver
+
+
+def temp_path(path):
+    """Return a hidden, process unique path next to path with the same extension."""
+    folder, name = os.path.split(path)
+    stem, ext = os.path.splitext(name)
+    return os.path.join(folder, ".%s.%d.tmp%s" % (stem, os.getpid(), ext))
+
+
+def replace_file(source, destination):
+    """Move source over destination in a single atomic rename.
+
+    Python 2 has no os.replace and its os.rename fails on Windows when
+    destination exists, so MoveFileExW is called directly there.
+    """
+    if hasattr(os, "replace"):
+        os.replace(source, destination)
+    elif os.name == "nt":
+        _move_file_replace(source, destination)
+    else:
+        os.rename(source, destination)
+
+
+def _move_file_replace(source, destination):
+    encoding = sys.getfilesystemencoding()
+    if isinstance(source, bytes):
+        source = source.decode(encoding)
+    if isinstance(destination, bytes):
+        destination = destination.decode(encoding)
+    if not ctypes.windll.kernel32.MoveFileExW(
+            source, destination,
+            MOVEFILE_REPLACE_EXISTING | MOVEFILE_WRITE_THROUGH):
+        raise ctypes.WinError()
+
+
+def scratch_path(filename):
+    """Create a new, uniquely named file for filename in the local scratch folder.
+
+    Returns:
+        str: The path of the empty file, ending in filename
+    """
+    if not os.path.isdir(SCRATCH_FOLDER):
+        make_folder(SCRATCH_FOLDER)
+    handle, path = tempfile.mkstemp(prefix="%d_" % os.getpid(),
+                                    suffix="_" + filename, dir=SCRATCH_FOLDER)
+    os.close(handle)
+    return path
+
+
+def atomic_write(path, write):
+    """Write a file through a temporary file so readers never see it partial.
+
+    Args:
+        path (str): Final path of the file
+        write (callable): Called with the temporary path to write to
+
+    Returns:
+        str: The final path
+    """
+    temporary = temp_path(path)
+    existed = os.path.exists(path)
+    try:
+        with timing.span("save.write_file"):
+            write(temporary)
+        with timing.span("save.replace_file"):
+            replace_file(temporary, path)
+    except Exception:
+        if existed and not os.path.exists(path):
+            # Never delete what may now be the only copy of the file.
+            log.error("Replacing %s failed, the new file is kept at %s",
+                      path, temporary)
+        elif os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+    if timing.ENABLED:
+        timing.count("save.bytes_written", os.path.getsize(path))
+    return path
+
+
+class BackgroundCopy(threading.Thread):
+    """Copy a file to its final location on a background thread.
+
+    The copy is written through a temporary file and renamed into place, so
+    a slow network share never holds up the caller. The callbacks are
+    called from the background thread.
+
+    Args:
+        source (str): File to copy, usually a scene in the scratch folder
+        destination (str): Final path of the file
+        progress (callable): Called with the bytes copied and the total
+        finished (callable): Called with the destination once it is in place
+        failed (callable): Called with the exception if the copy failed
+        remove_source (bool): Whether to delete the source after the copy
+    """
+    BUFFER_SIZE = 4 * 1024 * 1024
+
+    def __init__(self, source, destination, progress=None, finished=None,
+                 failed=None, remove_source=True):
+        super(BackgroundCopy, self).__init__()
+        self.daemon = True
+        self.source = source
+        self.destination = destination
+        self.progress = progress
+        self.finished = finished
+        self.failed = failed
+        self.remove_source = remove_source
+
+    def run(self):
+        try:
+            atomic_write(self.destination, self._copy)
+            if self.remove_source:
+                os.remove(self.source)
+        except Exception as err:
+            log.exception("Failed to copy %s to %s", self.source, self.destination)
+            if self.failed:
+                self.failed(err)
+            return
+        if self.finished:
+            self.finished(self.destination)
+
+    def _copy(self, temporary):
+        total = os.path.getsize(self.source)
+        copied = 0
+        with open(self.source, "rb") as source, open(temporary, "wb") as destination:
+            while True:
+                data = source.read(self.BUFFER_SIZE)
+                if not data:
+                    break
+                destination.write(data)
+                copied += len(data)
+                timing.count("save.bytes_copied", len(data))
+                if self.progress:
+                    self.progress(copied, total)
+
+
+class VersionStore(object):
+    """Content addressed store of scene versions with deduplicated chunks.
+
+    Scenes are split into chunks at node boundaries chosen by their
+    content, so an edit only changes the chunks around it. Each chunk is
+    stored once, compressed, under its SHA-1 and every version keeps a
+    manifest listing its chunks. The store lives in a hidden ".versions"
+    folder next to the scenes.
+    """
+    FOLDER_NAME = ".versions"
+    BOUNDARY = re.compile(br"\ncreateNode |CREA")
+    MIN_CHUNK = 16 * 1024
+    MAX_CHUNK = 1024 * 1024
+    BOUNDARY_DIVISOR = 8
+    FINGERPRINT_SIZE = 64
+    READ_SIZE = 4 * 1024 * 1024
+    COMPRESSION = 1
+
+    def __init__(self, root):
+        self.root = root
+        self.objects_path = os.path.join(root, "objects")
+        self.manifests_path = os.path.join(root, "manifests")
+
+    @classmethod
+    def for_folder(cls, folder_path):
+        """Return the store of a scenes folder."""
+        return cls(os.path.join(folder_path, cls.FOLDER_NAME))
+
+    def split(self, data):
+        """Split file contents into content defined chunks."""
+        return list(self.iter_chunks(io.BytesIO(data)))
+
+    def iter_chunks(self, stream):
+        """Yield the content defined chunks of a binary stream.
+
+        The stream is read a block at a time and at most about MAX_CHUNK
+        plus a block is held in memory, whatever the size of the file.
+        """
+        pending = b""
+        scan = 0
+        while True:
+            block = stream.read(self.READ_SIZE)
+            pending += block
+            # A boundary is only judged once the bytes it is fingerprinted
+            # on have been read.
+            limit = len(pending)
+            if block:
+                limit -= self.FINGERPRINT_SIZE
+            start = 0
+            for match in self.BOUNDARY.finditer(pending, scan):
+                position = match.start()
+                if position >= limit:
+                    break
+                scan = match.end()
+                while position - start > self.MAX_CHUNK:
+                    yield pending[start:start + self.MAX_CHUNK]
+                    start += self.MAX_CHUNK
+                if position - start < self.MIN_CHUNK:
+                    continue
+                fingerprint = zlib.crc32(
+                    pending[position:position + self.FINGERPRINT_SIZE]) & 0xffffffff
+                if fingerprint % self.BOUNDARY_DIVISOR == 0:
+                    yield pending[start:position]
+                    start = position
+            scan = max(scan, limit)
+            while scan - start > self.MAX_CHUNK:
+                yield pending[start:start + self.MAX_CHUNK]
+                start += self.MAX_CHUNK
+            if not block:
+                if start < len(pending):
+                    yield pending[start:]
+                return
+            pending = pending[start:]
+            scan -= start
+
+    def add(self, path):
+        """Store a scene file and write its manifest.
+
+        Args:
+            path (str): Scene file to store
+
+        Returns:
+            dict: The manifest, with the compressed bytes of new chunks
+                under "new_bytes"
+        """
+        digest = hashlib.sha1()
+        chunk_hashes = []
+        new_bytes = 0
+        with timing.span("save.store_chunks"), open(path, "rb") as scene:
+            for chunk in self.iter_chunks(scene):
+                digest.update(chunk)
+                chunk_hash = hashlib.sha1(chunk).hexdigest()
+                chunk_hashes.append(chunk_hash)
+                object_path = self._object_path(chunk_hash)
+                if os.path.exists(object_path):
+                    continue
+                compressed = zlib.compress(chunk, self.COMPRESSION)
+                self._write(object_path, compressed)
+                new_bytes += len(compressed)
+        timing.count("save.store_new_bytes", new_bytes)
+        stat = os.stat(path)
+        manifest = {"filename": os.path.basename(path),
+                    "size": stat.st_size,
+                    "mtime": stat.st_mtime,
+                    "sha1": digest.hexdigest(),
+                    "chunks": chunk_hashes}
+        self._write(self._manifest_path(manifest["filename"]),
+                    json.dumps(manifest).encode("utf-8"))
+        manifest["new_bytes"] = new_bytes
+        return manifest
+
+    def manifest(self, filename):
+        """Return the manifest of a stored scene, or None."""
+        try:
+            with open(self._manifest_path(filename), "rb") as manifest:
+                return json.loads(manifest.read().decode("utf-8"))
+        except (IOError, OSError):
+            return None
+
+    def filenames(self):
+        """Return the names of every stored scene."""
+        if not os.path.isdir(self.manifests_path):
+            return []
+        return [name[:-len(".json")] for name in os.listdir(self.manifests_path)
+                if name.endswith(".json")]
+
+    def is_stored(self, path):
+        """Return True if path is stored unchanged since it was added."""
+        manifest = self.manifest(os.path.basename(path))
+        if manifest is None or not os.path.exists(path):
+            return False
+        stat = os.stat(path)
+        return stat.st_size == manifest["size"] and stat.st_mtime == manifest["mtime"]
+
+    def restore(self, filename, destination):
+        """Rebuild a stored scene as a normal file.
+
+        The restored file gets a new mtime, so prune leaves it in the folder
+        rather than deleting a version an artist just opened.
+
+        Args:
+            filename (str): Name of the stored scene
+            destination (str): Path to write the scene to
+
+        Returns:
+            str: The destination path
+        """
+        manifest = self.manifest(filename)
+        if manifest is None:
+            raise IOError("%s is not in the version store %s" % (filename, self.root))
+
+        def write(temporary):
+            digest = hashlib.sha1()
+            with open(temporary, "wb") as scene:
+                for chunk_hash in manifest["chunks"]:
+                    with open(self._object_path(chunk_hash), "rb") as chunk_file:
+                        chunk = zlib.decompress(chunk_file.read())
+                    digest.update(chunk)
+                    scene.write(chunk)
+            if digest.hexdigest() != manifest["sha1"]:
+                raise IOError("Restored %s does not match its manifest" % filename)
+        atomic_write(destination, write)
+        return destination
+
+    def remove(self, filename):
+        """Forget a stored scene, keeping the chunks it shares with others.
+
+        Returns:
+            bool: False if the scene was not stored
+        """
+        try:
+            os.remove(self._manifest_path(filename))
+        except OSError as err:
+            if err.errno != errno.ENOENT:
+                raise
+            return False
+        return True
+
+    def prune(self, folder_path, keep):
+        """Delete older versions of keep that are safely in the store.
+
+        Only files named like keep apart from a lower version are deleted,
+        so the latest version of every other scene stays a normal file.
+
+        Args:
+            folder_path (str): Scenes folder of the store
+            keep (str): File name of the version just saved
+
+        Returns:
+            list: The deleted file names
+        """
+        keep_fields = SCHEMA.parse(keep)
+        if keep_fields is None:
+            return []
+        keep_key = SCHEMA.key(keep_fields)
+        removed = []
+        for filename in self.filenames():
+            fields = SCHEMA.parse(filename)
+            if (fields is None or SCHEMA.key(fields) != keep_key
+                    or fields["ver"] >= keep_fields["ver"]):
+                continue
+            path = os.path.join(folder_path, filename)
+            if self.is_stored(path):
+                os.remove(path)
+                removed.append(filename)
+        return removed
+
+    def _object_path(self, chunk_hash):
+        return os.path.join(self.objects_path, chunk_hash[:2], chunk_hash[2:])
+
+    def _manifest_path(self, filename):
+        return os.path.join(self.manifests_path, filename + ".json")
+
+    def _write(self, path, data):
+        folder = os.path.dirname(path)
+        if not os.path.isdir(folder):
+            make_folder(folder)
+
+        def write(temporary):
+            with open(temporary, "wb") as stored:
+                stored.write(data)
+        atomic_write(path, write)
+
+
+class HistoryIndex(object):
+    """Persistent history of the versions saved to a folder.
+
+    Every save records the version, time, author, file size and a snapshot
+    of scene statistics in an SQLite database in the folder's ".versions"
+    folder, so the history can be paged through without listing the folder.
+    """
+    FILENAME = "history.db"
+    TIMEOUT = 10.0
+    COLUMNS = ("filename", "descriptor", "task", "ver", "ext", "saved",
+               "author", "size", "stats")
+
+    def __init__(self, folder_path):
+        self.folder_path = folder_path
+        self.path = os.path.join(folder_path, VersionStore.FOLDER_NAME,
+                                 self.FILENAME)
+
+    def exists(self):
+        """Return True if the folder has a history."""
+        return os.path.exists(self.path)
+
+    def record(self, path, stats=None, author=None, saved=None):
+        """Record a saved scene version.
+
+        Args:
+            path (str): Path of the saved scene
+            stats (dict): Scene statistics to keep with the version
+            author (str): Artist who saved, defaults to the current user
+            saved (float): Time of the save, defaults to the file's mtime
+
+        Returns:
+            bool: False if the file name does not follow the naming schema
+        """
+        if author is None:
+            author = getpass.getuser()
+        row = self._row(path, stats, author, saved)
+        if row is None:
+            return False
+        self._insert([row])
+        return True
+
+    def version(self, filename):
+        """Return the recorded version of a file name, or None."""
+        connection = self._connect()
+        try:
+            row = connection.execute(
+                "SELECT %s FROM versions WHERE filename = ?" % ", ".join(self.COLUMNS),
+                (filename,)).fetchone()
+        finally:
+            connection.close()
+        if row is None:
+            return None
+        version = dict(zip(self.COLUMNS, row))
+        version["stats"] = json.loads(version["stats"])
+        return version
+
+    def remove(self, filename):
+        """Forget the recorded version of a file name."""
+        connection = self._connect()
+        try:
+            with connection:
+                connection.execute("DELETE FROM versions WHERE filename = ?",
+                                   (filename,))
+        finally:
+            connection.close()
+
+    def rebuild(self):
+        """Record every scene in the folder missing from the history.
+
+        Returns:
+            int: Number of versions added
+        """
+        known = set(row["filename"] for row in self.page(0, -1))
+        rows = [self._row(os.path.join(self.folder_path, name))
+                for name in os.listdir(self.folder_path) if name not in known]
+        rows = [row for row in rows if row is not None]
+        self._insert(rows)
+        return len(rows)
+
+    def count(self, descriptor=None, task=None):
+        """Return the number of recorded versions."""
+        where, args = self._where(descriptor, task)
+        connection = self._connect()
+        try:
+            return connection.execute("SELECT COUNT(*) FROM versions" + where,
+                                      args).fetchone()[0]
+        finally:
+            connection.close()
+
+    def page(self, offset, limit, descriptor=None, task=None):
+        """Return recorded versions, newest first.
+
+        Args:
+            offset (int): Number of versions to skip
+            limit (int): Maximum number of versions, -1 for all of them
+            descriptor (str): Only return versions with this descriptor
+            task (str): Only return versions with this task
+
+        Returns:
+            list: A dict per version with the keys in COLUMNS
+        """
+        where, args = self._where(descriptor, task)
+        connection = self._connect()
+        try:
+            rows = connection.execute(
+                "SELECT %s FROM versions%s ORDER BY saved DESC, ver DESC "
+                "LIMIT ? OFFSET ?" % (", ".join(self.COLUMNS), where),
+                args + [limit, offset]).fetchall()
+        finally:
+            connection.close()
+        versions = []
+        for row in rows:
+            version = dict(zip(self.COLUMNS, row))
+            version["stats"] = json.loads(version["stats"])
+            versions.append(version)
+        return versions
+
+    def _row(self, path, stats=None, author="", saved=None):
+        filename = os.path.basename(path)
+        fields = SCHEMA.parse(filename)
+        if fields is None:
+            return None
+        stat = os.stat(path)
+        return (filename, fields.get("descriptor", ""), fields.get("task", ""),
+                fields["ver"], fields.get("ext", ""),
+                stat.st_mtime if saved is None else saved, author,
+                stat.st_size, json.dumps(stats or {}))
+
+    def _insert(self, rows):
+        connection = self._connect()
+        try:
+            with connection:
+                connection.executemany(
+                    "INSERT OR REPLACE INTO versions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    rows)
+        finally:
+            connection.close()
+
+    def _where(self, descriptor, task):
+        clauses = []
+        args = []
+        if descriptor:
+            clauses.append("descriptor = ?")
+            args.append(descriptor)
+        if task:
+            clauses.append("task = ?")
+            args.append(task)
+        if not clauses:
+            return "", args
+        return " WHERE " + " AND ".join(clauses), args
+
+    def _connect(self):
+        folder = os.path.dirname(self.path)
+        if not os.path.isdir(folder):
+            make_folder(folder)
+        connection = sqlite3.connect(self.path, timeout=self.TIMEOUT)
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS versions (filename TEXT PRIMARY KEY, "
+            "descriptor TEXT, task TEXT, ver INTEGER, ext TEXT, saved REAL, "
+            "author TEXT, size INTEGER, stats TEXT)")
+        connection.execute(
+            "CREATE INDEX IF NOT EXISTS versions_saved ON versions (saved, ver)")
+        return connection
@@ -0,0 +1,305 @@
+"""Scene file naming, versioning and saving for Smart Save.
+
+SceneFile only imports maya.cmds when it talks to the scene, so the path
+logic can be used from plain Python and mayapy batch jobs without loading
+Qt or pymel.
+"""
+import os
+import contextlib
+import getpass
+import logging
+
+import smartsave_core
+import timing
+
+log = logging.getLogger(__name__)
+
+SCENE_FORMATS = sorted(smartsave_core.SCENE_TYPES)
+
+
+def maya_cmds():
+    """Import maya.cmds on first use."""
+    import maya.cmds as cmds
+    return cmds
+
+
+class SceneFile(object):
+    """"An abstract representation of a Scene file."""
+    __slots__ = ("_folder_path", "descriptor", "task", "ver", "ext", "tokens",
+                 "dedupe", "background_copy")
+
+    def __init__(self, path=None):
+        self.descriptor = 'main'
+        self.task = 'model'
+        self.ver = 1
+        self.ext = '.ma'
+        self.tokens = self.default_tokens()
+        self.dedupe = False
+        self.background_copy = None
+        if path:
+            self._init_from_path(path)
+            return
+        cmds = maya_cmds()
+        self._folder_path = os.path.join(
+            cmds.workspace(query=True, rootDirectory=True), "scenes")
+        scene = cmds.file(query=True, sceneName=True)
+        if not scene:
+            log.info("Initialize with default properties.")
+            return
+        if not self.is_valid(scene):
+            log.warning("%s does not match the naming schema %s. Initialize with "
+                        "default properties.", scene, smartsave_core.SCHEMA.template)
+            return
+        self._init_from_path(scene)
+
+    @staticmethod
+    def default_tokens():
+        """Return the naming schema tokens other than descriptor, task, ver and ext."""
+        tokens = {}
+        for token in smartsave_core.SCHEMA.key_tokens:
+            if token not in ("descriptor", "task", "ext"):
+                tokens[token] = getpass.getuser() if token == "user" else ""
+        return tokens
+
+    @staticmethod
+    def is_valid(path):
+        """Return True if the file name of path matches the naming schema."""
+        return smartsave_core.SCHEMA.parse(os.path.basename(path)) is not None
+
+    def validate(self):
+        """Check that the scene name parses back to the same tokens.
+
+        A name the naming schema cannot parse would never be seen by the
+        version index or the history, e.g. one with an empty token or a
+        token containing an underscore.
+
+        Raises:
+            ValueError: If the scene name does not follow the naming schema
+        """
+        fields = dict(self.tokens, descriptor=self.descriptor, task=self.task,
+                      ver=self.ver, ext=self.ext)
+        missing = [token for token in smartsave_core.SCHEMA.tokens
+                   if fields.get(token) in (None, "")]
+        if missing:
+            raise ValueError("Fill in the %s of the scene name" % ", ".join(missing))
+        parsed = smartsave_core.SCHEMA.parse(self.filename)
+        if parsed is None or any(parsed[token] != fields[token] for token in parsed):
+            raise ValueError("%s does not match the naming schema %s"
+                             % (self.filename, smartsave_core.SCHEMA.template))
+
+    @property
+    def folder_path(self):
+        return self._folder_path
+
+    @folder_path.setter
+    def folder_path(self, val):
+        self._folder_path = val
+
+    @property
+    def filename(self):
+        return smartsave_core.scene_filename(self.descriptor, self.task,
+                                             self.ver, self.ext, **self.tokens)
+
+    @property
+    def path(self):
+        return os.path.join(self.folder_path, self.filename)
+
+    def _init_from_path(self, path):
+        folder_path, filename = os.path.split(path)
+        fields = smartsave_core.SCHEMA.parse(filename)
+        if fields is None:
+            raise ValueError("%s does not match the naming schema %s"
+                             % (filename, smartsave_core.SCHEMA.template))
+        self.folder_path = folder_path
+        self.descriptor = fields.pop("descriptor", "")
+        self.task = fields.pop("task", "")
+        self.ver = fields.pop("ver")
+        self.ext = fields.pop("ext", "")
+        self.tokens = fields
+
+    def save(self, background=False, progress=None, finished=None, failed=None):
+        """Saves the scene file.
+
+        The scene is written to a temporary file first and renamed over the
+        final path, so other artists never open a partially written scene.
+        A background save writes the scene to the local scratch folder and
+        copies it to the final path on a background thread. With dedupe on,
+        the saved scene is added to the folder's version store and older
+        versions kept in the store are removed from the folder.
+
+        Args:
+            background (bool): Whether to copy to the folder in the background
+            progress (callable): Called with the bytes copied and the total
+            finished (callable): Called with the path once the copy is done
+            failed (callable): Called with the exception if the copy failed
+
+        Returns:
+            str: The path to the scene file if successful
+
+        Raises:
+            RuntimeError: If a background save is still copying
+            ValueError: If the scene name does not follow the naming schema
+        """
+        self._check_background_copy()
+        self.validate()
+        if background:
+            return self._save_in_background(progress, finished, failed)
+        with timing.span("save.maya_save"):
+            path = self.path
+            with self._keep_scene_name(path):
+                smartsave_core.atomic_write(path, self._save_as)
+        smartsave_core.VersionIndex.for_folder(self.folder_path).add(
+            self.descriptor, self.task, self.ver, self.ext, **self.tokens)
+        self._record_history(path, self.scene_stats())
+        if self.dedupe:
+            self._store_version(path)
+        return path
+
+    def scene_stats(self):
+        """Return a snapshot of statistics of the open scene."""
+        cmds = maya_cmds()
+        meshes = cmds.ls(type="mesh", noIntermediate=True)
+        return {"nodes": len(cmds.ls()),
+                "meshes": len(meshes),
+                "faces": cmds.polyEvaluate(meshes, face=True) if meshes else 0}
+
+    def _record_history(self, path, stats):
+        try:
+            with timing.span("save.record_history"):
+                smartsave_core.HistoryIndex(os.path.dirname(path)).record(path, stats)
+        except (IOError, OSError, smartsave_core.sqlite3.Error):
+            log.exception("Could not record %s in the version history", path)
+
+    def _store_version(self, path):
+        folder_path = os.path.dirname(path)
+        store = smartsave_core.VersionStore.for_folder(folder_path)
+        with timing.span("save.store_version"):
+            manifest = store.add(path)
+            removed = store.prune(folder_path, manifest["filename"])
+        log.info("Stored %s with %d new bytes, removed %d stored versions",
+                 manifest["filename"], manifest["new_bytes"], len(removed))
+
+    def open(self):
+        """Opens the scene file.
+
+        A version only kept in the version store is restored to a normal
+        scene file in the folder first.
+
+        Returns:
+            str: The path to the opened scene file
+        """
+        path = self.path
+        if not os.path.exists(path):
+            store = smartsave_core.VersionStore.for_folder(self.folder_path)
+            store.restore(self.filename, path)
+        maya_cmds().file(path, open=True, force=True)
+        return path
+
+    def _save_in_background(self, progress, finished, failed):
+        path = self.path
+        local_path = smartsave_core.scratch_path(self.filename)
+        with timing.span("save.maya_save"):
+            with self._keep_scene_name(path):
+                self._save_as(local_path)
+        smartsave_core.VersionIndex.for_folder(self.folder_path).add(
+            self.descriptor, self.task, self.ver, self.ext, **self.tokens)
+
+        def copy_failed(error):
+            if os.path.exists(local_path):
+                log.error("Background save failed, the scene is kept at %s",
+                          local_path)
+            else:
+                log.error("Background save of %s failed", path)
+            if os.path.exists(path) and not os.path.getsize(path):
+                os.remove(path)
+            if failed:
+                failed(error)
+
+        def copy_finished(copied_path):
+            self._record_history(copied_path, stats)
+            if dedupe:
+                try:
+                    self._store_version(copied_path)
+                except (IOError, OSError):
+                    log.exception("Could not add %s to the version store", copied_path)
+            if finished:
+                finished(copied_path)
+        dedupe = self.dedupe
+        stats = self.scene_stats()
+        smartsave_core.make_folder(self.folder_path)
+        self.background_copy = smartsave_core.BackgroundCopy(
+            local_path, path, progress, copy_finished, copy_failed)
+        self.background_copy.start()
+        return path
+
+    @contextlib.contextmanager
+    def _keep_scene_name(self, path):
+        """Name the open scene path after a save, or restore its name if it fails.
+
+        _save_as renames the scene to the file it writes, which is a hidden
+        temporary file that is gone once the save is over either way.
+        """
+        cmds = maya_cmds()
+        scene_name = cmds.file(query=True, sceneName=True) or path
+        try:
+            yield
+            scene_name = path
+        finally:
+            cmds.file(rename=scene_name)
+
+    def _check_background_copy(self):
+        """Refuse to save while the last background save is still copying.
+
+        A second copy could otherwise finish first and be replaced by the
+        older scene.
+        """
+        if self.background_copy is not None and self.background_copy.is_alive():
+            raise RuntimeError("%s is still being copied to the scenes folder"
+                               % os.path.basename(self.background_copy.destination))
+
+    def _save_as(self, path):
+        cmds = maya_cmds()
+        cmds.file(rename=path)
+        scene_type = smartsave_core.SCENE_TYPES[os.path.splitext(path)[1]]
+        try:
+            cmds.file(save=True, type=scene_type)
+        except RuntimeError:
+            log.warning("Missing directories in path. Creating folder...")
+            smartsave_core.make_folder(os.path.dirname(path))
+            cmds.file(save=True, type=scene_type)
+
+    def next_avail_ver(self):
+        """Return the next available version number in the folder."""
+        with timing.span("save.next_avail_ver"):
+            index = smartsave_core.VersionIndex.for_folder(self.folder_path)
+            return index.latest(self.descriptor, self.task, self.ext, **self.tokens) + 1
+
+    def save_increment(self, **kwargs):
+        """Increments the version and saves the scene file.
+
+        If the existing version of a file already exists, it should increment from the largest
+        version number available in the folder. The version is reserved on disk before saving
+        so artists saving to the same folder at the same time never get the same version.
+
+        Args:
+            **kwargs: Background save options passed on to save()
+
+        Returns:
+            str: The path to the scene file if successful
+
+        Raises:
+            RuntimeError: If a background save is still copying
+            ValueError: If the scene name does not follow the naming schema
+        """
+        self._check_background_copy()
+        self.validate()
+        smartsave_core.make_folder(self.folder_path)
+        with timing.span("save.reserve_version"):
+            self.ver = smartsave_core.reserve_version(self.folder_path, self.descriptor,
+                                                      self.task, self.ext, **self.tokens)
+        try:
+            return self.save(**kwargs)
+        except Exception:
+            if os.path.exists(self.path) and not os.path.getsize(self.path):
+                os.remove(self.path)
+            raise
@@ -0,0 +1,92 @@
+"""Stress test concurrent Smart Save increments on one folder.
+
+Starts several processes that reserve versions and atomically write scene
+files into the same folder, then checks that no version was lost or
+written twice::
+
+    python smartsave_stress.py --processes 16 --saves 50
+"""
+import os
+import argparse
+import logging
+import tempfile
+import timeit
+import multiprocessing
+
+import smartsave_core
+
+
+log = logging.getLogger(__name__)
+
+
+def save_increments(args):
+    """Reserve and write versions from one process.
+
+    Returns:
+        list: (version, seconds) of every save
+    """
+    folder_path, worker, saves = args
+    results = []
+    for number in range(saves):
+        start = timeit.default_timer()
+        ver = smartsave_core.reserve_version(folder_path, "stress", "test", ".ma")
+        path = os.path.join(folder_path,
+                            smartsave_core.scene_filename("stress", "test", ver, ".ma"))
+
+        def write(temporary):
+            with open(temporary, "w") as scene:
+                scene.write("%d:%d\n" % (worker, number))
+        smartsave_core.atomic_write(path, write)
+        results.append((ver, timeit.default_timer() - start))
+    return results
+
+
+def run_stress(folder_path, processes, saves):
+    """Hammer folder_path from several processes and verify the result.
+
+    Returns:
+        dict: Counts of saves, lost and duplicated versions and latencies
+    """
+    pool = multiprocessing.Pool(processes)
+    try:
+        results = pool.map(save_increments,
+                           [(folder_path, worker, saves) for worker in range(processes)])
+    finally:
+        pool.close()
+        pool.join()
+    versions = [ver for worker_results in results for ver, _ in worker_results]
+    latencies = sorted(seconds for worker_results in results
+                       for _, seconds in worker_results)
+    contents = set()
+    for name in os.listdir(folder_path):
+        with open(os.path.join(folder_path, name)) as scene:
+            contents.add(scene.read())
+    expected = processes * saves
+    return {"saves": len(versions),
+            "duplicate_versions": len(versions) - len(set(versions)),
+            "lost_versions": expected - len(contents),
+            "files": len(os.listdir(folder_path)),
+            "max_version": max(versions),
+            "median_seconds": latencies[len(latencies) // 2],
+            "max_seconds": latencies[-1]}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--processes", type=int, default=8)
+    parser.add_argument("--saves", type=int, default=25,
+                        help="versions saved by every process")
+    parser.add_argument("--folder", help="folder to save to, a temporary "
+                                         "folder by default")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    folder_path = args.folder or tempfile.mkdtemp(prefix="smartsave_stress_")
+    report = run_stress(folder_path, args.processes, args.saves)
+    for key in sorted(report):
+        log.info("%-20s %s", key, report[key])
+    if report["duplicate_versions"] or report["lost_versions"]:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
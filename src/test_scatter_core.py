@@ -0,0 +1,102 @@
+"""Headless tests of the Scatter Tool core against InMemoryBackend.
+
+Run without Maya from the src folder::
+
+    python -m unittest test_scatter_core
+"""
+import math
+import unittest
+
+import scatter_core
+
+
+def make_terrain(resolution):
+    backend = scatter_core.InMemoryBackend()
+    indices = backend.add_terrain("terrain", resolution)
+    return backend, [("terrain", list(indices))]
+
+
+class AlignRowsTest(unittest.TestCase):
+
+    def assert_orthonormal(self, rows):
+        for row in rows:
+            for value in row:
+                self.assertFalse(math.isnan(value))
+            self.assertAlmostEqual(scatter_core._length(row), 1.0)
+        for first, second in ((0, 1), (0, 2), (1, 2)):
+            dot = sum(a * b for a, b in zip(rows[first], rows[second]))
+            self.assertAlmostEqual(dot, 0.0)
+
+    def test_normal_parallel_to_up_axis(self):
+        for up_axis, normal in (("y", (0.0, 1.0, 0.0)),
+                                ("y", (0.0, -3.0, 0.0)),
+                                ("z", (0.0, 0.0, 1.0)),
+                                ("x", (-1.0, 0.0, 0.0))):
+            rows = scatter_core.align_rows([normal], up_axis)[0]
+            self.assert_orthonormal(rows)
+            unit = scatter_core._normalize(normal)
+            for value, expected in zip(rows[1], unit):
+                self.assertAlmostEqual(value, expected)
+
+    def test_zero_normal_keeps_world_frame(self):
+        rows = scatter_core.align_rows([(0.0, 0.0, 0.0)])[0]
+        self.assertEqual(rows, (scatter_core.UP_AXES["x"],
+                                scatter_core.UP_AXES["y"],
+                                scatter_core.UP_AXES["z"]))
+
+
+class WorkersTest(unittest.TestCase):
+
+    def test_matrices_do_not_depend_on_workers(self):
+        backend, vertices = make_terrain(160)
+        scatter_fx = scatter_core.ScatterFX()
+        scatter_fx.seed = 7
+        points = scatter_fx.sample_points(vertices, backend)
+        self.assertGreater(len(points.positions), scatter_core.CHUNK_SIZE)
+        all_matrices = []
+        for workers in (1, 2):
+            scatter_fx.workers = workers
+            matrices = []
+            for chunk in scatter_fx.iter_transforms(points.positions,
+                                                    points.normals):
+                matrices.extend(chunk)
+            all_matrices.append(matrices)
+        self.assertEqual(len(all_matrices[0]), len(points.positions))
+        self.assertEqual(all_matrices[0], all_matrices[1])
+
+
+class CacheTest(unittest.TestCase):
+
+    def test_rescatter_moves_cached_nodes_in_place(self):
+        backend, vertices = make_terrain(20)
+        cache = scatter_core.ScatterCache()
+        scatter_fx = scatter_core.ScatterFX()
+        scatter_fx.seed = 3
+        points = scatter_fx.sample_points(vertices, backend, cache)
+        for _ in scatter_fx.iter_scatter("rock", points, backend):
+            pass
+        nodes = list(points.nodes)
+        before = dict(backend.instances)
+        self.assertEqual(len(nodes), len(points.positions))
+
+        scatter_fx.rot_y_max = 90.0
+        self.assertIs(scatter_fx.sample_points(vertices, backend, cache), points)
+        for _ in scatter_fx.iter_scatter("rock", points, backend):
+            pass
+        self.assertEqual(points.nodes, nodes)
+        self.assertEqual([name for name, _ in backend.instances], nodes)
+        self.assertNotEqual(dict(backend.instances), before)
+
+    def test_mesh_change_invalidates_cache(self):
+        backend, vertices = make_terrain(20)
+        cache = scatter_core.ScatterCache()
+        scatter_fx = scatter_core.ScatterFX()
+        scatter_fx.seed = 3
+        points = scatter_fx.sample_points(vertices, backend, cache)
+        backend.add_terrain("terrain", 20, height=2.0)
+        self.assertIsNot(scatter_fx.sample_points(vertices, backend, cache),
+                         points)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,124 @@
+"""Named timing spans and counters for the scatter and save hot paths.
+
+Timing is off unless SFA_TIMING is set in the environment or enable() is
+called. While it is off a span is a shared no-op context manager and a
+count returns straight away, so instrumented code pays one function call::
+
+    with timing.span("scatter.sample"):
+        ...
+    timing.count("scatter.points", len(points))
+    timing.log_report(log)
+"""
+import os
+import json
+import timeit
+import threading
+
+ENABLED = bool(os.environ.get("SFA_TIMING"))
+
+_lock = threading.Lock()
+_spans = {}
+_counters = {}
+
+
+class _NullSpan(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class _Span(object):
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = timeit.default_timer()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = timeit.default_timer() - self.start
+        with _lock:
+            stats = _spans.get(self.name)
+            if stats is None:
+                _spans[self.name] = [1, elapsed, elapsed]
+            else:
+                stats[0] += 1
+                stats[1] += elapsed
+                stats[2] = max(stats[2], elapsed)
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def enable(enabled=True):
+    """Turn timing on or off."""
+    global ENABLED
+    ENABLED = enabled
+
+
+def span(name):
+    """Return a context manager timing the code it wraps under name."""
+    if not ENABLED:
+        return _NULL_SPAN
+    return _Span(name)
+
+
+def count(name, value=1):
+    """Add value to the counter name."""
+    if not ENABLED:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def reset():
+    """Forget every span and counter recorded so far."""
+    with _lock:
+        _spans.clear()
+        _counters.clear()
+
+
+def report():
+    """Return the spans and counters recorded so far.
+
+    Returns:
+        dict: "spans" maps every span name to its calls, total and max
+            seconds, "counters" maps every counter name to its value
+    """
+    with _lock:
+        spans = dict((name, {"calls": calls, "total_seconds": total,
+                             "max_seconds": longest})
+                     for name, (calls, total, longest) in _spans.items())
+        return {"spans": spans, "counters": dict(_counters)}
+
+
+def to_json(indent=None):
+    """Return the report as JSON."""
+    return json.dumps(report(), indent=indent, sort_keys=True)
+
+
+def log_report(logger, reset_after=True):
+    """Write the report to logger, slowest spans first.
+
+    Args:
+        logger (logging.Logger): Logger to write to
+        reset_after (bool): Whether to reset the report once it is written
+    """
+    if not ENABLED:
+        return
+    current = report()
+    spans = sorted(current["spans"].items(),
+                   key=lambda item: item[1]["total_seconds"], reverse=True)
+    for name, stats in spans:
+        logger.info("%-28s %6d calls %10.4fs total %10.4fs max", name,
+                    stats["calls"], stats["total_seconds"], stats["max_seconds"])
+    for name in sorted(current["counters"]):
+        logger.info("%-28s %d", name, current["counters"][name])
+    if reset_after:
+        reset()